@@ -0,0 +1,7 @@
+from django.utils.functional import SimpleLazyObject
+from cart.storage import get_cart_count
+
+
+def cart_count(request):
+    """给所有模板提供购物车条目数，只有模板用到时才读取"""
+    return {'cart_count': SimpleLazyObject(lambda: get_cart_count(request))}
@@ -0,0 +1,187 @@
+import json
+from django.conf import settings
+from django.db import transaction
+from django_redis import get_redis_connection
+from redis.exceptions import ResponseError
+from cart.models import CartArchive
+from cart.storage import CART_ARCHIVED_KEY, cart_key, cart_total_key
+from goods.models import GoodsSKU
+
+# 取出长期未访问的购物车并从redis中删除，执行期间再被访问的购物车跳过
+# KEYS: n个cart_用户id、n个cart_total_用户id、cart_archived
+# ARGV[1]: 空闲秒数  ARGV[2:]: 对应的用户id
+# 返回{用户id, hgetall结果, ...}
+# 先用object idletime判断，不会更新key的访问时间
+ARCHIVE_CARTS_SCRIPT = """
+local n = #ARGV - 1
+local result = {}
+for i = 1, n do
+    local idle = redis.call('object', 'idletime', KEYS[i])
+    if idle and idle >= tonumber(ARGV[1]) then
+        result[#result + 1] = ARGV[i + 1]
+        result[#result + 1] = redis.call('hgetall', KEYS[i])
+        redis.call('del', KEYS[i], KEYS[n + i])
+        redis.call('sadd', KEYS[2 * n + 1], ARGV[i + 1])
+    end
+end
+return result
+"""
+
+# 重写超长的购物车：删除已不存在的商品，然后删除hash重新写入，同时重新计算总件数
+# 已经变为hashtable编码的hash即使删除元素也不会再转回紧凑编码，重写后元素个数不超过
+# hash-max-ziplist-entries时重新使用紧凑编码
+# KEYS[1]: cart_用户id  KEYS[2]: cart_total_用户id  ARGV: 要删除的商品id
+# 返回剩余的条目数
+COMPACT_CART_SCRIPT = """
+local removed = {}
+for _, sku_id in ipairs(ARGV) do
+    removed[sku_id] = true
+end
+local items = redis.call('hgetall', KEYS[1])
+redis.call('del', KEYS[1])
+local total = 0
+local kept = 0
+for i = 1, #items, 2 do
+    if not removed[items[i]] then
+        redis.call('hset', KEYS[1], items[i], items[i + 1])
+        total = total + tonumber(items[i + 1])
+        kept = kept + 1
+    end
+end
+redis.call('set', KEYS[2], total)
+return kept
+"""
+
+# 每批处理的购物车数
+ARCHIVE_BATCH_SIZE = 200
+
+# redis没有开放CONFIG命令时使用的hash-max-ziplist-entries默认值
+DEFAULT_ZIPLIST_ENTRIES = 128
+
+
+def _memory_usage(conn, keys):
+    """批量获取key占用的内存字节数，redis不支持MEMORY命令时都为0"""
+    pipe = conn.pipeline(transaction=False)
+    for key in keys:
+        pipe.execute_command('MEMORY', 'USAGE', key)
+    try:
+        return [size or 0 for size in pipe.execute()]
+    except ResponseError:
+        return [0] * len(keys)
+
+
+def _archive_batch(conn, script, batch, idle_seconds):
+    """归档一批购物车，返回(归档数, 释放的内存字节数)"""
+    keys = [cart_key(user_id) for user_id in batch]
+    total_keys = [cart_total_key(user_id) for user_id in batch]
+    sizes = _memory_usage(conn, keys + total_keys)
+    sizes = {user_id: sizes[i] + sizes[len(batch) + i] for i, user_id in enumerate(batch)}
+
+    result = script(keys=keys + total_keys + [CART_ARCHIVED_KEY], args=[idle_seconds] + batch)
+    carts = {}
+    for i in range(0, len(result), 2):
+        items = result[i + 1]
+        items = [v.decode() if isinstance(v, bytes) else v for v in items]
+        carts[int(result[i])] = dict(zip(items[::2], items[1::2]))
+    if not carts:
+        return 0, 0
+
+    try:
+        with transaction.atomic():
+            CartArchive.objects.filter(user_id__in=list(carts)).delete()
+            CartArchive.objects.bulk_create([CartArchive(user_id=user_id, items=json.dumps(items))
+                                             for user_id, items in carts.items()])
+    except Exception:
+        # 写入数据库失败，把购物车放回redis
+        pipe = conn.pipeline()
+        for user_id, items in carts.items():
+            if items:
+                pipe.hmset(cart_key(user_id), items)
+            pipe.delete(cart_total_key(user_id))
+            pipe.srem(CART_ARCHIVED_KEY, user_id)
+        pipe.execute()
+        raise
+
+    # 执行期间被访问的购物车没有归档，只统计实际归档的部分
+    return len(carts), sum(sizes[user_id] for user_id in carts)
+
+
+def _ziplist_entries(conn):
+    """hash使用紧凑编码的最大元素个数"""
+    try:
+        config = conn.config_get('hash-max-ziplist-entries')
+    except ResponseError:
+        return DEFAULT_ZIPLIST_ENTRIES
+    return int(config.get('hash-max-ziplist-entries', DEFAULT_ZIPLIST_ENTRIES))
+
+
+def compact_cart(conn, user_id, max_entries):
+    """删除购物车中已不存在的商品并重写hash，返回删除的条目数
+
+    只有存在已删除的商品并且重写后可以恢复紧凑编码时才重写
+    """
+    sku_ids = [int(sku_id) for sku_id in conn.hkeys(cart_key(user_id))]
+    existing = set(GoodsSKU.objects.filter(id__in=sku_ids).values_list('id', flat=True))
+    removed = [sku_id for sku_id in sku_ids if sku_id not in existing]
+    if not removed or len(sku_ids) - len(removed) > max_entries:
+        return 0
+    conn.register_script(COMPACT_CART_SCRIPT)(keys=[cart_key(user_id), cart_total_key(user_id)], args=removed)
+    return len(removed)
+
+
+def archive_idle_carts(idle_days=None, conn=None):
+    """把长期未访问的购物车批量归档到数据库并从redis中删除
+
+    先用object命令判断空闲时间，不会更新访问时间，长期未访问的超长购物车同样归档
+    上次执行之后被访问过的超长购物车删除已不存在的商品并重写，读取购物车不会推迟其他购物车的归档
+    返回{'scanned': 扫描数, 'archived': 归档数, 'reclaimed_bytes': 释放的内存,
+         'oversized': 超长购物车数, 'compacted_lines': 删除的条目数}
+    """
+    if idle_days is None:
+        idle_days = settings.CART_ARCHIVE_IDLE_DAYS
+    if conn is None:
+        conn = get_redis_connection('default')
+    idle_seconds = int(idle_days * 24 * 3600)
+    script = conn.register_script(ARCHIVE_CARTS_SCRIPT)
+    max_entries = _ziplist_entries(conn)
+    report = {'scanned': 0, 'archived': 0, 'reclaimed_bytes': 0, 'oversized': 0, 'compacted_lines': 0}
+
+    def process(user_ids):
+        # 一次往返获取每个购物车的空闲时间和编码，object命令不会更新访问时间
+        # 超过hash-max-ziplist-entries的购物车编码变为hashtable
+        pipe = conn.pipeline(transaction=False)
+        for user_id in user_ids:
+            pipe.execute_command('OBJECT', 'IDLETIME', cart_key(user_id))
+            pipe.execute_command('OBJECT', 'ENCODING', cart_key(user_id))
+        values = pipe.execute()
+        idle = []
+        for user_id, idletime, encoding in zip(user_ids, values[::2], values[1::2]):
+            if idletime is None:
+                continue
+            if idletime >= idle_seconds:
+                idle.append(user_id)
+            elif encoding in (b'hashtable', 'hashtable'):
+                report['oversized'] += 1
+                # 读取购物车会重置空闲时间，只处理上次执行之后被访问过的购物车
+                if idletime < settings.CART_ARCHIVE_INTERVAL:
+                    report['compacted_lines'] += compact_cart(conn, user_id, max_entries)
+        if idle:
+            archived, reclaimed = _archive_batch(conn, script, idle, idle_seconds)
+            report['archived'] += archived
+            report['reclaimed_bytes'] += reclaimed
+
+    batch = []
+    for key in conn.scan_iter(match='cart_*', count=1000):
+        key = key.decode() if isinstance(key, bytes) else key
+        user_id = key[len('cart_'):]
+        # 跳过cart_total_、cart_archived等其他key
+        if not user_id.isdigit():
+            continue
+        report['scanned'] += 1
+        batch.append(int(user_id))
+        if len(batch) >= ARCHIVE_BATCH_SIZE:
+            process(batch)
+            batch = []
+    if batch:
+        process(batch)
+    return report
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from cart.lifecycle import archive_idle_carts
+
+
+class Command(BaseCommand):
+    help = '把长期未访问的购物车归档到数据库并从redis中删除'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--idle-days', type=float, default=None,
+                            help='超过多少天未访问的购物车归档，默认为CART_ARCHIVE_IDLE_DAYS')
+
+    def handle(self, *args, **options):
+        report = archive_idle_carts(options['idle_days'])
+        self.stdout.write('扫描%(scanned)d个购物车，归档%(archived)d个，释放内存%(reclaimed_bytes)d字节' % report)
+        self.stdout.write('超长购物车%(oversized)d个，删除失效条目%(compacted_lines)d条' % report)
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from cart.storage import repair_cart_totals
+
+
+class Command(BaseCommand):
+    help = '根据购物车记录重新计算所有用户购物车的商品总件数'
+
+    def handle(self, *args, **options):
+        repaired = repair_cart_totals()
+        self.stdout.write('修复完成，共%d个购物车' % repaired)
@@ -1,3 +1,14 @@
 from django.db import models
-
+from db.base_model import BaseModel
 # Create your models here.
+
+
+class CartArchive(BaseModel):
+    '''长期未使用的购物车归档模型类'''
+    user = models.OneToOneField('user.User', verbose_name='用户')
+    items = models.TextField(verbose_name='购物车记录')  # json: {商品id: 数量}
+
+    class Meta:
+        db_table = 'df_cart_archive'
+        verbose_name = '购物车归档'
+        verbose_name_plural = verbose_name
@@ -0,0 +1,380 @@
+import json
+import time
+import uuid
+from django.conf import settings
+from django_redis import get_redis_connection
+from goods.stock import SKU_STOCK_KEY, load_stocks, get_stocks
+
+# session中保存购物车条目数的key，值为[条目数, 过期时间戳]
+CART_COUNT_SESSION_KEY = 'cart_count'
+
+# 未登录用户购物车id的cookie，使用签名防止伪造
+GUEST_CART_COOKIE = 'guest_cart'
+GUEST_CART_COOKIE_SALT = 'cart.guest_cart'
+
+# 已归档到数据库的用户购物车，set中保存用户id，再次访问时恢复到redis
+CART_ARCHIVED_KEY = 'cart_archived'
+
+# 添加购物车的结果
+CART_ADD_OK = 1
+CART_ADD_NO_STOCK = 0
+CART_ADD_NO_SKU = -1
+
+# 修改购物车的脚本发现购物车已归档时返回的结果，恢复之后重新执行
+CART_NEEDS_RESTORE = -2
+
+# 购物车中商品的总件数单独保存在cart_total_用户id中，每次修改购物车时在同一个脚本中更新
+# 旧的购物车没有总件数时，先根据hash计算一次，save为false时只计算不保存
+# KEYS[1]: cart_用户id  KEYS[2]: cart_total_用户id
+CART_TOTAL_LUA = """
+local function cart_total(save)
+    local total = redis.call('get', KEYS[2])
+    if total then
+        return tonumber(total)
+    end
+    total = 0
+    for _, count in ipairs(redis.call('hvals', KEYS[1])) do
+        total = total + tonumber(count)
+    end
+    if save ~= false then
+        redis.call('set', KEYS[2], total)
+    end
+    return total
+end
+"""
+
+# 修改用户购物车之前检查是否已被归档，与修改在同一次往返中完成
+# KEYS[#KEYS]: cart_archived  ARGV[1]: 用户id，未登录用户为空字符串
+CART_ARCHIVED_LUA = """
+if ARGV[1] ~= '' and redis.call('sismember', KEYS[#KEYS], ARGV[1]) == 1 then
+    return {-2, 0, 0}
+end
+"""
+
+# 添加购物车记录：累加数量、校验库存缓存、返回条目数，一次往返redis完成
+# KEYS[3]: 库存缓存  KEYS[4]: cart_archived
+# ARGV[2]: 商品id  ARGV[3]: 添加的数量  ARGV[4]: 过期时间，0表示不过期(未登录用户的购物车会过期)
+# 返回{结果, 条目数, 总件数}，库存没有缓存时返回{-1, 0, 0}
+# 库存不足时不写入任何key，未登录用户被拒绝的添加不会留下没有过期时间的总件数
+CART_ADD_SCRIPT = CART_TOTAL_LUA + CART_ARCHIVED_LUA + """
+local stock = redis.call('hget', KEYS[3], ARGV[2])
+if not stock then
+    return {-1, 0, 0}
+end
+local count = tonumber(redis.call('hget', KEYS[1], ARGV[2]) or '0') + tonumber(ARGV[3])
+if count > tonumber(stock) then
+    return {0, redis.call('hlen', KEYS[1]), cart_total(false)}
+end
+cart_total()
+redis.call('hset', KEYS[1], ARGV[2], count)
+local total = redis.call('incrby', KEYS[2], ARGV[3])
+if tonumber(ARGV[4]) > 0 then
+    redis.call('expire', KEYS[1], ARGV[4])
+    redis.call('expire', KEYS[2], ARGV[4])
+end
+return {1, redis.call('hlen', KEYS[1]), total}
+"""
+
+# 设置购物车中商品的数量
+# KEYS[3]: cart_archived
+# ARGV[2]: 商品id  ARGV[3]: 数量
+# 返回{条目数, 总件数}
+CART_UPDATE_SCRIPT = CART_TOTAL_LUA + CART_ARCHIVED_LUA + """
+cart_total()
+local old = tonumber(redis.call('hget', KEYS[1], ARGV[2]) or '0')
+redis.call('hset', KEYS[1], ARGV[2], ARGV[3])
+local total = redis.call('incrby', KEYS[2], tonumber(ARGV[3]) - old)
+return {redis.call('hlen', KEYS[1]), total}
+"""
+
+# 删除购物车中的商品
+# KEYS[3]: cart_archived
+# ARGV[2:]: 商品id
+# 返回{条目数, 总件数}
+CART_DELETE_SCRIPT = CART_TOTAL_LUA + CART_ARCHIVED_LUA + """
+cart_total()
+local removed = 0
+for i = 2, #ARGV do
+    local count = redis.call('hget', KEYS[1], ARGV[i])
+    if count then
+        redis.call('hdel', KEYS[1], ARGV[i])
+        removed = removed + tonumber(count)
+    end
+end
+local total = redis.call('decrby', KEYS[2], removed)
+return {redis.call('hlen', KEYS[1]), total}
+"""
+
+# 批量修改购物车，所有操作在一个脚本中原子地完成
+# KEYS[3]: 库存缓存  KEYS[4]: cart_archived
+# ARGV[2:]: 每三个一组，操作(add/update/delete)、商品id、数量
+# 返回{每个操作的结果, 条目数, 总件数}，结果为1成功、0库存不足、-1库存没有缓存
+CART_BATCH_SCRIPT = CART_TOTAL_LUA + CART_ARCHIVED_LUA + """
+local total = cart_total()
+local results = {}
+for i = 2, #ARGV, 3 do
+    local op, sku_id, count = ARGV[i], ARGV[i + 1], tonumber(ARGV[i + 2])
+    local old = tonumber(redis.call('hget', KEYS[1], sku_id) or '0')
+    local result = 1
+    if op == 'delete' then
+        redis.call('hdel', KEYS[1], sku_id)
+        total = total - old
+    else
+        local new = count
+        if op == 'add' then
+            new = old + count
+        end
+        local stock = redis.call('hget', KEYS[3], sku_id)
+        if not stock then
+            result = -1
+        elseif new > tonumber(stock) then
+            result = 0
+        else
+            redis.call('hset', KEYS[1], sku_id, new)
+            total = total + new - old
+        end
+    end
+    results[#results + 1] = result
+end
+redis.call('set', KEYS[2], total)
+return {results, redis.call('hlen', KEYS[1]), total}
+"""
+
+# 登录时把未登录时的购物车合并到用户购物车，数量不超过库存，合并后删除未登录购物车
+# KEYS[3]: 库存缓存  KEYS[4]: guest_cart_id  KEYS[5]: guest_cart_total_id
+# 返回{条目数, 总件数}
+CART_MERGE_SCRIPT = CART_TOTAL_LUA + """
+local total = cart_total()
+local items = redis.call('hgetall', KEYS[4])
+for i = 1, #items, 2 do
+    local sku_id = items[i]
+    local stock = redis.call('hget', KEYS[3], sku_id)
+    if stock then
+        local old = tonumber(redis.call('hget', KEYS[1], sku_id) or '0')
+        local new = math.min(old + tonumber(items[i + 1]), tonumber(stock))
+        if new > old then
+            redis.call('hset', KEYS[1], sku_id, new)
+            total = total + new - old
+        end
+    end
+end
+redis.call('set', KEYS[2], total)
+redis.call('del', KEYS[4], KEYS[5])
+return {redis.call('hlen', KEYS[1]), total}
+"""
+
+# 根据hash重新计算总件数
+CART_REPAIR_SCRIPT = """
+local total = 0
+for _, count in ipairs(redis.call('hvals', KEYS[1])) do
+    total = total + tonumber(count)
+end
+redis.call('set', KEYS[2], total)
+return total
+"""
+
+
+def cart_key(user_id):
+    """用户购物车在redis中的key"""
+    return 'cart_%d' % user_id
+
+
+def cart_total_key(user_id):
+    """用户购物车商品总件数在redis中的key"""
+    return 'cart_total_%d' % user_id
+
+
+def guest_cart_key(guest_id):
+    """未登录用户购物车在redis中的key"""
+    return 'guest_cart_%s' % guest_id
+
+
+def guest_cart_total_key(guest_id):
+    """未登录用户购物车商品总件数在redis中的key"""
+    return 'guest_cart_total_%s' % guest_id
+
+
+def get_guest_cart_id(request):
+    """从签名cookie中获取未登录用户的购物车id，没有或签名错误时返回None"""
+    return request.get_signed_cookie(GUEST_CART_COOKIE, default=None, salt=GUEST_CART_COOKIE_SALT)
+
+
+def new_guest_cart_id():
+    return uuid.uuid4().hex
+
+
+def set_guest_cart_cookie(response, guest_id):
+    """设置未登录用户购物车id的cookie，与redis中的购物车同时过期"""
+    response.set_signed_cookie(GUEST_CART_COOKIE, guest_id, salt=GUEST_CART_COOKIE_SALT,
+                               max_age=settings.GUEST_CART_TTL, httponly=True)
+
+
+def set_cart_count(request, count):
+    """购物车条目数发生变化后，保存到当前请求和session中"""
+    request._cart_count = count
+    request.session[CART_COUNT_SESSION_KEY] = [count, time.time() + settings.CART_COUNT_SESSION_TTL]
+
+
+def remember_cart_count(request, count):
+    """保存本次请求中已经读到的条目数，不写session"""
+    request._cart_count = count
+
+
+def clear_cart_count(request):
+    """购物车在别处被修改，清除保存的条目数，下次重新从redis读取"""
+    if hasattr(request, '_cart_count'):
+        del request._cart_count
+    request.session.pop(CART_COUNT_SESSION_KEY, None)
+
+
+def get_cart_count(request):
+    """获取用户购物车中商品的条目数，每个请求最多读取一次
+
+    优先使用session中未过期的条目数，购物车没有变化时不需要访问redis
+    """
+    user = request.user
+    if user.is_authenticated():
+        key = cart_key(user.id)
+    else:
+        # 未登录用户使用cookie中的购物车
+        guest_id = get_guest_cart_id(request)
+        if guest_id is None:
+            return 0
+        key = guest_cart_key(guest_id)
+
+    if hasattr(request, '_cart_count'):
+        return request._cart_count
+
+    cached = request.session.get(CART_COUNT_SESSION_KEY)
+    if cached and cached[1] > time.time():
+        request._cart_count = cached[0]
+    else:
+        conn = get_redis_connection('default')
+        count = conn.hlen(key)
+        if count == 0 and user.is_authenticated():
+            # 购物车为空时检查是否已被归档
+            count = restore_archived_cart(conn, user.id) or 0
+        set_cart_count(request, count)
+    return request._cart_count
+
+
+def restore_archived_cart(conn, user_id):
+    """把已归档到数据库的购物车恢复到redis，返回恢复后的条目数，没有归档时返回None
+
+    归档之后新添加的商品保留redis中的数量
+    """
+    if not conn.sismember(CART_ARCHIVED_KEY, user_id):
+        return None
+    from cart.models import CartArchive
+    archive = CartArchive.objects.filter(user_id=user_id).first()
+    pipe = conn.pipeline()
+    if archive is not None:
+        for sku_id, count in json.loads(archive.items).items():
+            pipe.hsetnx(cart_key(user_id), sku_id, count)
+        conn.register_script(CART_REPAIR_SCRIPT)(keys=[cart_key(user_id), cart_total_key(user_id)], client=pipe)
+    pipe.srem(CART_ARCHIVED_KEY, user_id)
+    pipe.hlen(cart_key(user_id))
+    line_count = pipe.execute()[-1]
+    if archive is not None:
+        archive.delete()
+    return line_count
+
+
+def _run_cart_script(conn, script, user_id, keys, args):
+    """执行修改购物车的脚本，用户购物车已归档时先恢复再重新执行，未登录用户的user_id为None
+
+    购物车没有归档时只需要一次往返redis
+    """
+    keys = keys + [CART_ARCHIVED_KEY]
+    args = ['' if user_id is None else user_id] + list(args)
+    result = script(keys=keys, args=args)
+    if result[0] == CART_NEEDS_RESTORE:
+        restore_archived_cart(conn, user_id)
+        result = script(keys=keys, args=args)
+    return result
+
+
+def _add_to_cart(conn, user_id, keys, sku_id, count, ttl=0):
+    script = conn.register_script(CART_ADD_SCRIPT)
+    keys = keys + [SKU_STOCK_KEY]
+    result, line_count, total_count = _run_cart_script(conn, script, user_id, keys, [sku_id, count, ttl])
+    if result == CART_ADD_NO_SKU:
+        # 库存没有缓存，从数据库读取后重试，商品不存在时直接返回
+        if not load_stocks([sku_id], conn):
+            return CART_ADD_NO_SKU, 0, 0
+        result, line_count, total_count = _run_cart_script(conn, script, user_id, keys, [sku_id, count, ttl])
+    return result, line_count, total_count
+
+
+def add_to_cart(conn, user_id, sku_id, count):
+    """原子地添加购物车记录，数量不能超过库存
+
+    返回(结果, 购物车条目数, 总件数)，结果为CART_ADD_OK、CART_ADD_NO_STOCK或CART_ADD_NO_SKU
+    """
+    return _add_to_cart(conn, user_id, [cart_key(user_id), cart_total_key(user_id)], sku_id, count)
+
+
+def add_to_guest_cart(conn, guest_id, sku_id, count):
+    """添加未登录用户的购物车记录，每次添加都会延长购物车的有效期，返回值同add_to_cart"""
+    return _add_to_cart(conn, None, [guest_cart_key(guest_id), guest_cart_total_key(guest_id)],
+                        sku_id, count, settings.GUEST_CART_TTL)
+
+
+def merge_guest_cart(conn, guest_id, user_id):
+    """登录时把未登录用户的购物车合并到用户购物车，返回(条目数, 总件数)"""
+    # 先保证未登录购物车中所有商品的库存都已缓存
+    sku_ids = conn.hkeys(guest_cart_key(guest_id))
+    if sku_ids:
+        get_stocks(sku_ids, conn)
+
+    script = conn.register_script(CART_MERGE_SCRIPT)
+    line_count, total_count = script(keys=[cart_key(user_id), cart_total_key(user_id), SKU_STOCK_KEY,
+                                           guest_cart_key(guest_id), guest_cart_total_key(guest_id)])
+    return line_count, total_count
+
+
+def update_cart(conn, user_id, sku_id, count):
+    """设置购物车中商品的数量，返回(条目数, 总件数)"""
+    script = conn.register_script(CART_UPDATE_SCRIPT)
+    line_count, total_count = _run_cart_script(conn, script, user_id, [cart_key(user_id), cart_total_key(user_id)],
+                                               [sku_id, count])
+    return line_count, total_count
+
+
+def delete_from_cart(conn, user_id, *sku_ids):
+    """删除购物车中的商品，返回(条目数, 总件数)"""
+    script = conn.register_script(CART_DELETE_SCRIPT)
+    line_count, total_count = _run_cart_script(conn, script, user_id, [cart_key(user_id), cart_total_key(user_id)],
+                                               sku_ids)
+    return line_count, total_count
+
+
+def batch_update_cart(conn, user_id, ops):
+    """批量修改购物车，ops为[(操作, 商品id, 数量)]
+
+    返回(每个操作的结果, 条目数, 总件数)，结果为CART_ADD_OK、CART_ADD_NO_STOCK或CART_ADD_NO_SKU
+    """
+    script = conn.register_script(CART_BATCH_SCRIPT)
+    args = []
+    for op, sku_id, count in ops:
+        args.extend([op, sku_id, count])
+    results, line_count, total_count = _run_cart_script(
+        conn, script, user_id, [cart_key(user_id), cart_total_key(user_id), SKU_STOCK_KEY], args)
+    return results, line_count, total_count
+
+
+def repair_cart_totals(conn=None):
+    """根据购物车记录重新计算所有用户购物车的总件数，返回修复的购物车数"""
+    if conn is None:
+        conn = get_redis_connection('default')
+    script = conn.register_script(CART_REPAIR_SCRIPT)
+    repaired = 0
+    for key in conn.scan_iter(match='cart_*', count=1000):
+        key = key.decode() if isinstance(key, bytes) else key
+        user_id = key[len('cart_'):]
+        # 跳过cart_total_等其他key
+        if not user_id.isdigit():
+            continue
+        script(keys=[key, cart_total_key(int(user_id))])
+        repaired += 1
+    return repaired
@@ -1,21 +1,25 @@
 from django.shortcuts import render
 from django.views.generic import View
 from django.http import JsonResponse
-from goods.models import GoodsSKU
 from django_redis import get_redis_connection
 from utils.mixin import LoginRequiredMixin
+from cart.storage import set_cart_count, add_to_cart, update_cart, delete_from_cart, batch_update_cart, \
+    add_to_guest_cart, get_guest_cart_id, new_guest_cart_id, set_guest_cart_cookie, restore_archived_cart, \
+    CART_ADD_OK, CART_ADD_NO_SKU, CART_ADD_NO_STOCK
+from goods.stock import get_stocks
+from django.conf import settings
+import json
+from goods.sku_snapshot import get_sku_snapshots
 # Create your views here.
 
 
 # ajax发起的请求都在后台，浏览器上看不到效果，所以判断登录不能用mixin
+# 未登录用户也可以添加购物车，保存在签名cookie对应的redis购物车中
 # /cart/add
 class CartAddView(View):
     """购物车记录添加"""
     def post(self, request):
         user = request.user
-        if not user.is_authenticated():
-            # 用户未登录
-            return JsonResponse({'res': 0, 'errmsg': '请先登录'})
         # 接收数据
         sku_id = request.POST.get('sku_id')
         count = request.POST.get('count')
@@ -32,36 +36,37 @@ class CartAddView(View):
             # 数目出错
             return JsonResponse({'res': 2, 'errmsg': '商品数目出错'})
 
-        # 校验商品是否存在
+        # 校验商品id
         try:
-            sku = GoodsSKU.objects.get(id=sku_id)
+            sku_id = int(sku_id)
         except Exception as e:
             # 商品不存在
             return JsonResponse({'res': 3, 'errmsg': '商品不存在'})
 
         # 业务处理：添加购物车记录
+        # 在redis中原子地累加数量、校验库存缓存并返回购物车条目数
         conn = get_redis_connection('default')
-        cart_key = 'cart_%d' % user.id
-        # 先尝试获取sku_id的值 -> hget函数  传递 cart_key和属性
-        # 如果sku_id在hash中不存在，hget返回None
-        cart_count = conn.hget(cart_key, sku_id)
-        if cart_count:
-            # 累加购物车中商品的数目
-            count += int(cart_count)
-
-
-        # 校验商品的库存
-        if count > sku.stock:
+        guest_id = None
+        if user.is_authenticated():
+            result, total_count, _ = add_to_cart(conn, user.id, sku_id, count)
+        else:
+            # 用户未登录，添加到cookie对应的购物车中，登录时合并
+            guest_id = get_guest_cart_id(request) or new_guest_cart_id()
+            result, total_count, _ = add_to_guest_cart(conn, guest_id, sku_id, count)
+        if result == CART_ADD_NO_SKU:
+            # 商品不存在
+            return JsonResponse({'res': 3, 'errmsg': '商品不存在'})
+        if result == CART_ADD_NO_STOCK:
+            # 校验商品的库存
             return JsonResponse({'res': 4, 'errmsg': '商品库存不足'})
-        # 设置hash中sku_id对应的值
-
-        conn.hset(cart_key, sku_id, count)
-
-        # 计算用户购物车商品的的条目数
-        total_count = conn.hlen(cart_key)
+        set_cart_count(request, total_count)
 
         # 返回应答
-        return JsonResponse({'res': 5, 'total_count': total_count, 'message': '添加成功'})
+        response = JsonResponse({'res': 5, 'total_count': total_count, 'message': '添加成功'})
+        if guest_id is not None:
+            # 延长购物车cookie的有效期
+            set_guest_cart_cookie(response, guest_id)
+        return response
 
 
 # /cart/
@@ -74,6 +79,8 @@ class CartInfoView(LoginRequiredMixin, View):
         # 获取用户购物车中商品的信息
         conn = get_redis_connection('default')
         cart_key = 'cart_%d' % user.id
+        # 长期未访问的购物车已归档到数据库，先恢复
+        restore_archived_cart(conn, user.id)
         # {'商品id': 商品数量}
         cart_dict = conn.hgetall(cart_key)
 
@@ -81,10 +88,14 @@ class CartInfoView(LoginRequiredMixin, View):
         # 保存用户购物车中商品的总件数和总价
         total_count = 0
         total_price = 0
+        # 一次批量获取所有商品的快照信息
+        snapshots = get_sku_snapshots(cart_dict.keys(), conn)
         # 遍历获取商品的信息
         for sku_id, count in cart_dict.items():
-            # 根据商品的id，获取商品的信息
-            sku = GoodsSKU.objects.get(id=sku_id)
+            # 根据商品的id，获取商品的信息，商品已不存在时跳过
+            sku = snapshots.get(int(sku_id))
+            if sku is None:
+                continue
             # 计算商品的小计
             amount = sku.price * int(count)
             # 动态给sku对象增加属性amount和count，保存小计和数量
@@ -129,29 +140,22 @@ class CartUpdateView(View):
             # 数目出错
             return JsonResponse({'res': 2, 'errmsg': '商品数目出错'})
 
-        # 校验商品是否存在
+        # 校验商品是否存在，使用redis中的库存缓存
+        conn = get_redis_connection('default')
         try:
-            sku = GoodsSKU.objects.get(id=sku_id)
+            sku_id = int(sku_id)
+            stock = get_stocks([sku_id], conn)[sku_id]
         except Exception as e:
             # 商品不存在
             return JsonResponse({'res': 3, 'errmsg': '商品不存在'})
 
-        # 业务处理：更新购物车记录
-        conn = get_redis_connection('default')
-        cart_key = 'cart_%d' % user.id
-
         # 校验商品的库存
-        if count > sku.stock:
+        if count > stock:
             return JsonResponse({'res': 4, 'errmsg': '商品库存不足'})
 
-        # 更新
-        conn.hset(cart_key, sku_id, count)
-
-        # 计算用户购物车中商品的总件数
-        total_count = 0
-        vals = conn.hvals(cart_key)
-        for val in vals:
-            total_count += int(val)
+        # 业务处理：更新购物车记录，同时得到购物车中商品的总件数
+        line_count, total_count = update_cart(conn, user.id, sku_id, count)
+        set_cart_count(request, line_count)
 
         # 返回应答
         return JsonResponse({'res': 5, 'total_count': total_count, 'message': '更新成功'})
@@ -173,24 +177,79 @@ class CartDeleteView(View):
         if not sku_id:
             return JsonResponse({'res': 1, 'errmsg': "无效的商品id"})
 
-        # 校验商品是否存在
+        # 校验商品是否存在，使用redis中的库存缓存
+        conn = get_redis_connection('default')
         try:
-            sku = GoodsSKU.objects.get(id=sku_id)
-        except GoodsSKU.DoesNotExist:
+            sku_id = int(sku_id)
+        except Exception as e:
+            return JsonResponse({'res': 1, 'errmsg': "无效的商品id"})
+        if sku_id not in get_stocks([sku_id], conn):
             # 商品不存在
             return JsonResponse({'res': 2, 'errmsg': '商品不存在'})
 
-        # 业务处理 删除购物车记录
+        # 业务处理：删除购物车记录，同时得到购物车中商品的总件数
+        line_count, total_count = delete_from_cart(conn, user.id, sku_id)
+        set_cart_count(request, line_count)
+
+        # 返回应答
+        return JsonResponse({'res': 3, 'total_count': total_count, 'errmsg': '删除成功'})
+
+
+# ajax post
+# 前端传递的参数：操作列表的json字符串(ops)
+# [{"op": "add"/"update"/"delete", "sku_id": 商品id, "count": 数量}, ...]
+# /cart/batch
+class CartBatchView(View):
+    """购物车记录批量修改"""
+    def post(self, request):
+        """购物车记录批量修改"""
+        user = request.user
+        if not user.is_authenticated():
+            # 用户未登录
+            return JsonResponse({'res': 0, 'errmsg': '请先登录'})
+
+        # 接收数据
+        try:
+            ops = json.loads(request.POST.get('ops', ''))
+        except Exception as e:
+            return JsonResponse({'res': 1, 'errmsg': '数据不完整'})
+
+        # 数据校验
+        if not isinstance(ops, list) or not ops or len(ops) > settings.CART_BATCH_MAX_OPS:
+            return JsonResponse({'res': 1, 'errmsg': '数据不完整'})
+
+        parsed = []
+        for op in ops:
+            try:
+                action = op['op']
+                sku_id = int(op['sku_id'])
+                count = int(op.get('count', 0))
+            except Exception as e:
+                return JsonResponse({'res': 2, 'errmsg': '商品数目出错'})
+            if action not in ('add', 'update', 'delete'):
+                return JsonResponse({'res': 1, 'errmsg': '数据不完整'})
+            # 添加和更新的数量必须大于0
+            if action != 'delete' and count <= 0:
+                return JsonResponse({'res': 2, 'errmsg': '商品数目出错'})
+            parsed.append((action, sku_id, count))
+
+        # 一次校验所有商品是否存在，同时保证库存已缓存
         conn = get_redis_connection('default')
-        cart_key = 'cart_%d' % user.id
+        stocks = get_stocks([sku_id for action, sku_id, count in parsed], conn)
 
-        # 删除 hedl
-        conn.hdel(cart_key, sku_id)
-        # 计算用户购物车中商品的总件数
-        total_count = 0
-        vals = conn.hvals(cart_key)
-        for val in vals:
-            total_count += int(val)
+        # 每个操作的结果，商品不存在的操作不提交给redis
+        results = [{'sku_id': sku_id, 'res': 3, 'errmsg': '商品不存在'} for action, sku_id, count in parsed]
+        valid = [i for i, (action, sku_id, count) in enumerate(parsed) if sku_id in stocks]
+
+        # 业务处理：在一个redis脚本中完成所有修改，同时得到条目数和总件数
+        codes, line_count, total_count = batch_update_cart(conn, user.id, [parsed[i] for i in valid])
+        for i, code in zip(valid, codes):
+            if code == CART_ADD_OK:
+                results[i] = {'sku_id': parsed[i][1], 'res': 5, 'message': '修改成功'}
+            elif code == CART_ADD_NO_STOCK:
+                results[i] = {'sku_id': parsed[i][1], 'res': 4, 'errmsg': '商品库存不足'}
+        set_cart_count(request, line_count)
 
         # 返回应答
-        return JsonResponse({'res': 3, 'total_count': total_count, 'errmsg': '删除成功'})
\ No newline at end of file
+        return JsonResponse({'res': 5, 'results': results, 'line_count': line_count,
+                             'total_count': total_count, 'message': '修改完成'})
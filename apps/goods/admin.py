@@ -1,5 +1,6 @@
 from django.contrib import admin
-from django.core.cache import cache
+from goods.index_page import schedule_index_regeneration
+from goods.type_menu import bump_type_menu_version
 from goods.models import GoodsType, IndexPromotionBanner, IndexGoodsBanner, IndexTypeGoodsBanner, GoodsSKU, Goods, GoodsImage
 
 # Register your models here.
@@ -9,21 +10,22 @@ class BaseModelAdmin(admin.ModelAdmin):
         """新增或更新表中的数据时"""
         super().save_model(request, obj, form, change)
 
-        # 发出任务，让celery worker重新生成首页静态页面
-        from celery_tasks.tasks import generate_static_index_html
-        generate_static_index_html.delay()
+        # 商品种类修改后，通知各worker重新加载种类菜单
+        if isinstance(obj, GoodsType):
+            bump_type_menu_version()
 
-        # 清除首页的缓存数据
-        cache.delete('index_page_data')
+        # 标记首页数据已修改，静默期结束后由celery worker重新生成首页静态页面和缓存
+        schedule_index_regeneration()
 
     def delete_model(self, request, obj):
         """删除表中的数据时"""
         super().delete_model(request, obj)
 
-        from celery_tasks.tasks import generate_static_index_html
-        generate_static_index_html.delay()
-        # 清除首页的缓存数据
-        cache.delete('index_page_data')
+        if isinstance(obj, GoodsType):
+            bump_type_menu_version()
+
+        # 标记首页数据已修改，静默期结束后由celery worker重新生成首页静态页面和缓存
+        schedule_index_regeneration()
 
 
 class IndexPromotionBannerAdmin(BaseModelAdmin):
@@ -0,0 +1,10 @@
+from django.apps import AppConfig
+
+
+class GoodsConfig(AppConfig):
+    name = 'goods'
+    verbose_name = '商品模块'
+
+    def ready(self):
+        # 注册缓存失效的信号处理函数
+        import goods.signals
@@ -0,0 +1,64 @@
+from django.core.cache import cache
+from django.db.models import Q
+from goods.models import GoodsSKU
+from order.reviews import get_latest_reviews
+
+# 详情页数据缓存的过期时间
+DETAIL_PAGE_CACHE_TIMEOUT = 3600
+
+
+def detail_cache_key(sku_id):
+    """详情页数据的缓存key"""
+    return 'detail_page_data_%d' % int(sku_id)
+
+
+def get_detail_page_data(sku_id):
+    """获取详情页中与用户无关的数据(商品种类除外)，先查缓存，缓存中没有再查数据库，商品不存在时返回None"""
+    key = detail_cache_key(sku_id)
+    context = cache.get(key)
+    if context is not None:
+        return context
+
+    try:
+        sku = GoodsSKU.objects.select_related('type', 'goods').get(id=sku_id)
+    except GoodsSKU.DoesNotExist:
+        return None
+
+    # 获取商品的评论总数和最新的若干条评论
+    review_count, reviews = get_latest_reviews(sku.id)
+
+    # 获取新品信息
+    new_skus = list(GoodsSKU.objects.filter(type=sku.type).order_by('-create_time')[:2])
+
+    # 获取同一SPU的其他规格的商品
+    same_spu_skus = list(GoodsSKU.objects.filter(goods=sku.goods).exclude(id=sku.id))
+
+    context = {'sku': sku,
+               'review_count': review_count,
+               'reviews': reviews,
+               'new_skus': new_skus,
+               'same_spu_skus': same_spu_skus}
+
+    # 设置缓存
+    cache.set(key, context, DETAIL_PAGE_CACHE_TIMEOUT)
+    return context
+
+
+def invalidate_detail_pages(sku_ids):
+    """清除指定商品的详情页缓存"""
+    cache.delete_many([detail_cache_key(sku_id) for sku_id in sku_ids])
+
+
+def invalidate_related_detail_pages(type_id=None, goods_id=None):
+    """清除同一种类(新品推荐)或同一SPU(其他规格)的所有商品的详情页缓存"""
+    condition = Q()
+    if type_id is not None:
+        condition |= Q(type_id=type_id)
+    if goods_id is not None:
+        condition |= Q(goods_id=goods_id)
+    invalidate_detail_pages(GoodsSKU.objects.filter(condition).values_list('id', flat=True))
+
+
+def invalidate_all_detail_pages():
+    """清除所有商品的详情页缓存"""
+    cache.delete_pattern('detail_page_data_*')
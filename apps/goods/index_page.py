@@ -0,0 +1,126 @@
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+from collections import defaultdict
+from django.conf import settings
+from django_redis import get_redis_connection
+from goods.models import GoodsType, IndexGoodsBanner, IndexPromotionBanner, IndexTypeGoodsBanner
+try:
+    # brotli为可选依赖，没有安装时不生成.br文件
+    import brotli
+except ImportError:
+    brotli = None
+
+# 首页数据的版本号，每次后台修改都会加1
+INDEX_GENERATION_KEY = 'index_page_generation'
+# 首页数据已修改、静态首页还未重新生成的标记
+INDEX_DIRTY_KEY = 'index_page_dirty'
+# 生成静态首页时使用的锁，保证同一时间只有一个worker在生成
+INDEX_RENDER_LOCK_KEY = 'index_page_render_lock'
+
+# 只有版本号没有变化时才清除修改标记
+CLEAR_DIRTY_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[2])
+end
+return 0
+"""
+
+
+def get_index_page_data():
+    """组织首页数据，首页视图和celery生成静态首页共用"""
+    # 获取商品的种类信息
+    types = list(GoodsType.objects.all())
+
+    # 获取首页轮播商品信息，同时查出关联的sku
+    goods_banners = list(IndexGoodsBanner.objects.select_related('sku').order_by('index'))
+
+    # 获取首页促销活动信息
+    promotion_banners = list(IndexPromotionBanner.objects.all().order_by('index'))
+
+    # 一次查出所有种类的首页分类商品信息，在内存中按种类和展示类型分组
+    image_banners = defaultdict(list)
+    title_banners = defaultdict(list)
+    for banner in IndexTypeGoodsBanner.objects.select_related('sku').order_by('index'):
+        if banner.display_type == 1:
+            image_banners[banner.type_id].append(banner)
+        else:
+            title_banners[banner.type_id].append(banner)
+
+    for type in types:
+        # 动态增加type属性，分别保存首页分类商品的图片信息和文字信息
+        type.image_banners = image_banners[type.id]
+        type.title_banners = title_banners[type.id]
+
+    # 组织模板上下文
+    return {'types': types,
+            'goods_banners': goods_banners,
+            'promotion_banners': promotion_banners}
+
+
+def schedule_index_regeneration():
+    """首页数据发生变化，静默期结束后重新生成一次静态首页"""
+    conn = get_redis_connection('default')
+    # 版本号加1并设置修改标记
+    generation = conn.incr(INDEX_GENERATION_KEY)
+    conn.set(INDEX_DIRTY_KEY, generation)
+
+    # 延迟发出任务，静默期内的多次修改只有最后一个任务会真正生成首页
+    from celery_tasks.tasks import generate_static_index_html
+    generate_static_index_html.apply_async((generation,), countdown=settings.INDEX_REGENERATE_DELAY)
+
+
+def is_index_generation_current(conn, generation):
+    """判断任务的版本号是否是最新的，并且首页还需要重新生成"""
+    current, dirty = conn.mget(INDEX_GENERATION_KEY, INDEX_DIRTY_KEY)
+    return dirty is not None and int(current or 0) == generation
+
+
+def clear_index_dirty(conn, generation):
+    """静态首页生成完毕，版本号没有变化时清除修改标记"""
+    conn.eval(CLEAR_DIRTY_SCRIPT, 2, INDEX_GENERATION_KEY, INDEX_DIRTY_KEY, generation)
+
+
+def _atomic_write(path, data):
+    """先写入同目录下的临时文件，再原子地重命名，nginx不会读到写了一半的文件"""
+    dir_name, file_name = os.path.split(path)
+    fd, tmp_path = tempfile.mkstemp(prefix='.%s.' % file_name, dir=dir_name)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        # mkstemp创建的文件只有属主可读，改成nginx可读
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except Exception:
+        os.unlink(tmp_path)
+        raise
+
+
+def write_static_index(html):
+    """保存静态首页，同时生成预压缩的.gz/.br文件和记录ETag的清单文件"""
+    static_dir = os.path.join(settings.BASE_DIR, 'static')
+    save_path = os.path.join(static_dir, 'index.html')
+    content = html.encode('utf-8')
+    etag = hashlib.sha1(content).hexdigest()
+    manifest = {'etag': etag, 'size': len(content)}
+
+    # 先生成压缩文件，最后替换index.html，nginx的gzip_static/brotli_static直接使用
+    gz_content = gzip.compress(content, 9)
+    _atomic_write(save_path + '.gz', gz_content)
+    manifest['gz_size'] = len(gz_content)
+
+    br_path = save_path + '.br'
+    if brotli is not None:
+        br_content = brotli.compress(content)
+        _atomic_write(br_path, br_content)
+        manifest['br_size'] = len(br_content)
+    elif os.path.exists(br_path):
+        # 不能生成新的.br文件时删除旧文件，避免返回过期内容
+        os.unlink(br_path)
+
+    _atomic_write(save_path, content)
+    _atomic_write(os.path.join(static_dir, 'index.manifest.json'),
+                  json.dumps({'index.html': manifest}).encode('utf-8'))
+    return etag
@@ -0,0 +1,118 @@
+from django.core.cache import cache
+from django.core.paginator import Paginator, Page
+from django.db.models import Q
+from goods.models import GoodsSKU
+from goods.rankings import get_ranked_ids
+
+# 每页显示的商品数
+LIST_PAGE_SIZE = 5
+# 种类商品总数的缓存时间
+TYPE_COUNT_CACHE_TIMEOUT = 600
+
+# 排序方式 -> (排序字段, 是否降序)，相同值再按id排序，保证顺序唯一
+# 依赖(type, price)、(type, sales)联合索引和type外键索引
+SORT_FIELDS = {
+    'price': ('price', False),
+    'hot': ('sales', True),
+    'default': ('id', True),
+}
+
+
+class CountedPaginator(Paginator):
+    """总数由外部传入的分页器，不再执行COUNT(*)"""
+    def __init__(self, count, per_page):
+        super().__init__([], per_page)
+        self._known_count = count
+
+    @property
+    def count(self):
+        return self._known_count
+
+
+def type_count_key(type_id):
+    return 'type_sku_count_%d' % int(type_id)
+
+
+def get_type_sku_count(type_id):
+    """获取种类下的商品总数，优先使用缓存"""
+    key = type_count_key(type_id)
+    count = cache.get(key)
+    if count is None:
+        count = GoodsSKU.objects.filter(type_id=type_id).count()
+        cache.set(key, count, TYPE_COUNT_CACHE_TIMEOUT)
+    return count
+
+
+def invalidate_type_sku_count(type_id):
+    """种类下的商品发生变化时清除缓存的总数"""
+    cache.delete(type_count_key(type_id))
+
+
+def _ordering(field, desc):
+    if field == 'id':
+        return ('-id',) if desc else ('id',)
+    if desc:
+        return ('-%s' % field, '-id')
+    return (field, 'id')
+
+
+def _seek_filter(field, value, sku_id, greater):
+    """构造(排序字段, id)大于(greater)或小于cursor的过滤条件"""
+    op = 'gt' if greater else 'lt'
+    if field == 'id':
+        return Q(**{'id__%s' % op: sku_id})
+    return Q(**{'%s__%s' % (field, op): value}) | Q(**{field: value, 'id__%s' % op: sku_id})
+
+
+def _seek(skus, field, desc, cursor_id, forward):
+    """从cursor商品开始向后(forward)或向前查询一页"""
+    value = skus.filter(id=cursor_id).values_list(field, flat=True).first()
+    if value is None:
+        return None
+
+    # 降序排列时，向后翻页是取更小的值
+    greater = forward != desc
+    ordering = _ordering(field, desc if forward else not desc)
+    page_skus = list(skus.filter(_seek_filter(field, value, cursor_id, greater)).order_by(*ordering)[:LIST_PAGE_SIZE])
+    if not forward:
+        page_skus.reverse()
+    return page_skus
+
+
+def _offset(skus, field, desc, page):
+    """按页码查询：先只在索引上取出这一页的id，再按id查询商品"""
+    offset = (page - 1) * LIST_PAGE_SIZE
+    ids = list(skus.order_by(*_ordering(field, desc)).values_list('id', flat=True)[offset:offset + LIST_PAGE_SIZE])
+    sku_dict = GoodsSKU.objects.in_bulk(ids)
+    return [sku_dict[sku_id] for sku_id in ids if sku_id in sku_dict]
+
+
+def get_list_page(type_id, sort, page, after=None, before=None):
+    """获取种类列表页第page页的Page对象
+
+    价格和人气排序使用redis有序集合，默认排序查询数据库：
+    after/before为上一页最后一个/下一页第一个商品的id，传入时按游标直接定位，
+    否则按页码在索引上定位，都不需要COUNT(*)和扫描前面的整行数据。
+    """
+    if sort in ('price', 'hot'):
+        # 价格和人气排序直接从redis有序集合中取出这一页的商品id
+        count, page, ids = get_ranked_ids(type_id, sort, page, LIST_PAGE_SIZE)
+        sku_dict = GoodsSKU.objects.in_bulk(ids)
+        page_skus = [sku_dict[sku_id] for sku_id in ids if sku_id in sku_dict]
+        return Page(page_skus, page, CountedPaginator(count, LIST_PAGE_SIZE))
+
+    field, desc = SORT_FIELDS[sort]
+    paginator = CountedPaginator(get_type_sku_count(type_id), LIST_PAGE_SIZE)
+    if page < 1 or page > paginator.num_pages:
+        page = 1
+
+    skus = GoodsSKU.objects.filter(type_id=type_id)
+    page_skus = None
+    if page > 1 and after is not None:
+        page_skus = _seek(skus, field, desc, after, True)
+    elif before is not None:
+        page_skus = _seek(skus, field, desc, before, False)
+    if page_skus is None:
+        page_skus = _offset(skus, field, desc, page)
+
+    return Page(page_skus, page, paginator)
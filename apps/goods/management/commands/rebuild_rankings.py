@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from goods.rankings import rebuild_all_rankings
+
+
+class Command(BaseCommand):
+    help = '从数据库重建所有种类的价格和销量排序有序集合'
+
+    def handle(self, *args, **options):
+        result = rebuild_all_rankings()
+        for type_id, count in sorted(result.items()):
+            self.stdout.write('种类%d: %d个商品' % (type_id, count))
+        self.stdout.write('重建完成，共%d个种类' % len(result))
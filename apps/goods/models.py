@@ -40,6 +40,8 @@ class GoodsSKU(BaseModel):
         db_table = 'df_goods_sku'
         verbose_name = '商品'
         verbose_name_plural = verbose_name
+        # 列表页按价格、销量排序分页
+        index_together = [('type', 'price'), ('type', 'sales')]
 
     def __str__(self):
         return self.name
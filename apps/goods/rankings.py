@@ -0,0 +1,129 @@
+from django_redis import get_redis_connection
+from goods.models import GoodsType, GoodsSKU
+
+# 每个种类按价格和销量排序的有序集合，member为商品id，score为价格或销量
+# 有序集合不存在时视为需要重建，所以增量维护时只更新已存在的集合
+
+# KEYS[1]: 有序集合  ARGV[1]: score  ARGV[2]: 商品id
+ZADD_IF_EXISTS_SCRIPT = """
+if redis.call('exists', KEYS[1]) == 1 then
+    return redis.call('zadd', KEYS[1], ARGV[1], ARGV[2])
+end
+return 0
+"""
+
+# KEYS[1]: 有序集合  ARGV[1]: 增量  ARGV[2]: 商品id
+ZINCRBY_IF_EXISTS_SCRIPT = """
+if redis.call('exists', KEYS[1]) == 1 then
+    return redis.call('zincrby', KEYS[1], ARGV[1], ARGV[2])
+end
+return false
+"""
+
+
+def price_rank_key(type_id):
+    return 'type_price_%d' % int(type_id)
+
+
+def sales_rank_key(type_id):
+    return 'type_sales_%d' % int(type_id)
+
+
+def rebuild_type_rankings(type_id, conn=None):
+    """从数据库重建一个种类的价格和销量有序集合，返回商品数"""
+    if conn is None:
+        conn = get_redis_connection('default')
+    rows = list(GoodsSKU.objects.filter(type_id=type_id).values_list('id', 'price', 'sales'))
+
+    pipe = conn.pipeline()
+    for key, index in ((price_rank_key(type_id), 1), (sales_rank_key(type_id), 2)):
+        if not rows:
+            pipe.delete(key)
+            continue
+        # 先写入临时key再重命名，重建过程中不会读到不完整的集合
+        tmp_key = key + '_rebuild'
+        pipe.delete(tmp_key)
+        for start in range(0, len(rows), 500):
+            args = []
+            for row in rows[start:start + 500]:
+                args.extend([float(row[index]), row[0]])
+            pipe.execute_command('ZADD', tmp_key, *args)
+        pipe.rename(tmp_key, key)
+    pipe.execute()
+    return len(rows)
+
+
+def rebuild_all_rankings():
+    """重建所有种类的有序集合，用于修正增量维护产生的偏差"""
+    conn = get_redis_connection('default')
+    return {type_id: rebuild_type_rankings(type_id, conn)
+            for type_id in GoodsType.objects.values_list('id', flat=True)}
+
+
+def _zrange_page(conn, key, reverse, page, page_size):
+    """一次往返获取有序集合的元素个数和第page页的商品id"""
+    start = (page - 1) * page_size
+    pipe = conn.pipeline(transaction=False)
+    pipe.zcard(key)
+    if reverse:
+        pipe.zrevrange(key, start, start + page_size - 1)
+    else:
+        pipe.zrange(key, start, start + page_size - 1)
+    count, ids = pipe.execute()
+    return count, [int(sku_id) for sku_id in ids]
+
+
+def get_ranked_ids(type_id, sort, page, page_size):
+    """按价格升序或销量降序获取第page页的商品id
+
+    返回(商品总数, 实际页码, 商品id列表)，有序集合不存在时先从数据库重建
+    """
+    conn = get_redis_connection('default')
+    if sort == 'price':
+        key, reverse = price_rank_key(type_id), False
+    else:
+        key, reverse = sales_rank_key(type_id), True
+
+    if page < 1:
+        page = 1
+    count, ids = _zrange_page(conn, key, reverse, page, page_size)
+    if count == 0 and rebuild_type_rankings(type_id, conn) > 0:
+        count, ids = _zrange_page(conn, key, reverse, page, page_size)
+
+    # 页码超出范围时显示第一页
+    if not ids and page > 1:
+        page = 1
+        count, ids = _zrange_page(conn, key, reverse, page, page_size)
+    return count, page, ids
+
+
+def update_sku_rankings(sku):
+    """商品新增或修改后更新有序集合，种类变化时从其他种类中移除"""
+    conn = get_redis_connection('default')
+    script = conn.register_script(ZADD_IF_EXISTS_SCRIPT)
+    pipe = conn.pipeline()
+    for type_id in GoodsType.objects.exclude(id=sku.type_id).values_list('id', flat=True):
+        pipe.zrem(price_rank_key(type_id), sku.id)
+        pipe.zrem(sales_rank_key(type_id), sku.id)
+    script(keys=[price_rank_key(sku.type_id)], args=[float(sku.price), sku.id], client=pipe)
+    script(keys=[sales_rank_key(sku.type_id)], args=[sku.sales, sku.id], client=pipe)
+    pipe.execute()
+
+
+def remove_sku_rankings(sku):
+    """商品删除后从有序集合中移除"""
+    conn = get_redis_connection('default')
+    pipe = conn.pipeline()
+    pipe.zrem(price_rank_key(sku.type_id), sku.id)
+    pipe.zrem(sales_rank_key(sku.type_id), sku.id)
+    pipe.execute()
+
+
+def incr_sales_rankings(sales):
+    """订单提交后增加商品销量，sales为[(种类id, 商品id, 销量增量)]"""
+    conn = get_redis_connection('default')
+    script = conn.register_script(ZINCRBY_IF_EXISTS_SCRIPT)
+    pipe = conn.pipeline(transaction=False)
+    for type_id, sku_id, count in sales:
+        script(keys=[sales_rank_key(type_id)], args=[count, sku_id], client=pipe)
+    pipe.execute()
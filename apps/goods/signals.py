@@ -0,0 +1,58 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from goods.models import GoodsType, GoodsSKU, Goods, GoodsImage
+from goods.detail_page import invalidate_detail_pages, invalidate_related_detail_pages, invalidate_all_detail_pages
+from goods.list_page import invalidate_type_sku_count
+from goods.rankings import update_sku_rankings, remove_sku_rankings
+from goods.sku_snapshot import invalidate_sku_snapshots
+from goods.stock import set_stocks, remove_stocks
+from order.models import OrderGoods
+
+
+@receiver([post_save, post_delete], sender=GoodsSKU)
+def sku_changed(sender, instance, **kwargs):
+    """商品SKU修改后，清除同种类和同SPU商品的详情页缓存、种类商品总数以及商品快照"""
+    invalidate_detail_pages([instance.id])
+    invalidate_related_detail_pages(type_id=instance.type_id, goods_id=instance.goods_id)
+    # 清除种类商品总数的缓存和商品快照
+    invalidate_type_sku_count(instance.type_id)
+    invalidate_sku_snapshots([instance.id])
+
+
+@receiver(post_save, sender=GoodsSKU)
+def sku_saved(sender, instance, **kwargs):
+    """商品SKU新增或修改后，更新种类的价格和销量排序以及库存缓存"""
+    update_sku_rankings(instance)
+    set_stocks({instance.id: instance.stock})
+
+
+@receiver(post_delete, sender=GoodsSKU)
+def sku_deleted(sender, instance, **kwargs):
+    """商品SKU删除后，从种类的价格和销量排序以及库存缓存中移除"""
+    remove_sku_rankings(instance)
+    remove_stocks([instance.id])
+
+
+@receiver([post_save, post_delete], sender=Goods)
+def goods_changed(sender, instance, **kwargs):
+    """商品SPU修改后，清除该SPU下所有商品的详情页缓存"""
+    invalidate_related_detail_pages(goods_id=instance.id)
+
+
+@receiver([post_save, post_delete], sender=GoodsImage)
+def goods_image_changed(sender, instance, **kwargs):
+    """商品图片修改后，清除对应商品的详情页缓存"""
+    invalidate_detail_pages([instance.sku_id])
+
+
+@receiver([post_save, post_delete], sender=GoodsType)
+def goods_type_changed(sender, instance, **kwargs):
+    """商品种类修改后，所有详情页面包屑中的种类名称都需要更新"""
+    invalidate_all_detail_pages()
+
+
+@receiver([post_save, post_delete], sender=OrderGoods)
+def order_goods_changed(sender, instance, **kwargs):
+    """订单商品有评论时，清除对应商品的详情页缓存"""
+    if instance.comment:
+        invalidate_detail_pages([instance.sku_id])
@@ -0,0 +1,86 @@
+import json
+from decimal import Decimal
+from django_redis import get_redis_connection
+from goods.models import GoodsSKU
+
+# 每个商品快照保存在单独的key中，一次mget取出多个商品
+# 每个快照有自己的过期时间，即使漏掉了失效通知，过期后也会从数据库重新读取
+SKU_SNAPSHOT_TIMEOUT = 24 * 3600
+
+
+def sku_snapshot_key(sku_id):
+    return 'sku_snapshot_%d' % int(sku_id)
+
+
+class SKUSnapshot(object):
+    """商品SKU快照，只包含购物车、订单和用户中心页面需要的字段"""
+    FIELDS = ('id', 'name', 'price', 'unite', 'image_url', 'stock', 'status')
+
+    def __init__(self, id, name, price, unite, image_url, stock, status):
+        self.id = id
+        self.name = name
+        self.price = Decimal(price)
+        self.unite = unite
+        self.image_url = image_url
+        self.stock = stock
+        self.status = status
+
+    @classmethod
+    def from_sku(cls, sku):
+        return cls(sku.id, sku.name, sku.price, sku.unite, sku.image.url, sku.stock, sku.status)
+
+    @classmethod
+    def loads(cls, data):
+        return cls(*json.loads(data.decode() if isinstance(data, bytes) else data))
+
+    def dumps(self):
+        return json.dumps([self.id, self.name, str(self.price), self.unite,
+                           self.image_url, self.stock, self.status])
+
+
+def get_sku_snapshots(sku_ids, conn=None):
+    """批量获取商品快照，返回{商品id: SKUSnapshot}
+
+    先用一次mget从redis读取，缺失的商品用一次in_bulk查询数据库并写回redis，
+    数据库中也不存在的商品不在返回结果中
+    """
+    sku_ids = [int(sku_id) for sku_id in sku_ids]
+    if not sku_ids:
+        return {}
+    if conn is None:
+        conn = get_redis_connection('default')
+
+    snapshots = {}
+    missing = []
+    for sku_id, data in zip(sku_ids, conn.mget([sku_snapshot_key(sku_id) for sku_id in sku_ids])):
+        if data is None:
+            missing.append(sku_id)
+        else:
+            snapshots[sku_id] = SKUSnapshot.loads(data)
+
+    if missing:
+        fields = [field for field in SKUSnapshot.FIELDS if field != 'image_url'] + ['image']
+        skus = GoodsSKU.objects.only(*fields).in_bulk(missing)
+        loaded = {sku_id: SKUSnapshot.from_sku(sku) for sku_id, sku in skus.items()}
+        if loaded:
+            pipe = conn.pipeline(transaction=False)
+            for sku_id, snapshot in loaded.items():
+                pipe.set(sku_snapshot_key(sku_id), snapshot.dumps(), ex=SKU_SNAPSHOT_TIMEOUT)
+            pipe.execute()
+        snapshots.update(loaded)
+    return snapshots
+
+
+def get_ordered_sku_snapshots(sku_ids, conn=None):
+    """按sku_ids的顺序返回商品快照列表，跳过不存在的商品"""
+    snapshots = get_sku_snapshots(sku_ids, conn)
+    return [snapshots[int(sku_id)] for sku_id in sku_ids if int(sku_id) in snapshots]
+
+
+def invalidate_sku_snapshots(sku_ids, conn=None):
+    """商品信息或库存变化后删除快照"""
+    if not sku_ids:
+        return
+    if conn is None:
+        conn = get_redis_connection('default')
+    conn.delete(*[sku_snapshot_key(sku_id) for sku_id in sku_ids])
@@ -0,0 +1,133 @@
+from django.db.models import Case, When, Value, F, IntegerField
+from django_redis import get_redis_connection
+from goods.models import GoodsSKU
+
+# 商品库存缓存，field为商品id，value为库存
+# 购物车和下单校验库存时读取，订单提交和后台修改时写入，定时与数据库核对
+# 只有被访问过的商品才会缓存，所以缓存的都是热点商品
+SKU_STOCK_KEY = 'sku_stock'
+
+# 订单提交后减少缓存的库存，只更新已缓存的商品
+# 使用增量而不是写入新库存，多个订单并发提交时与执行顺序无关
+# ARGV: 每两个一组，商品id、减少的数量
+DECR_STOCKS_SCRIPT = """
+for i = 1, #ARGV, 2 do
+    if redis.call('hexists', KEYS[1], ARGV[i]) == 1 then
+        redis.call('hincrby', KEYS[1], ARGV[i], -tonumber(ARGV[i + 1]))
+    end
+end
+return 1
+"""
+
+
+def load_stocks(sku_ids, conn=None):
+    """从数据库读取商品库存并写入缓存，返回{商品id: 库存}，不存在的商品不在结果中"""
+    if conn is None:
+        conn = get_redis_connection('default')
+    stocks = dict(GoodsSKU.objects.filter(id__in=sku_ids).values_list('id', 'stock'))
+    if stocks:
+        conn.hmset(SKU_STOCK_KEY, stocks)
+    return stocks
+
+
+def get_stocks(sku_ids, conn=None):
+    """批量获取商品库存，缓存中没有的从数据库读取"""
+    sku_ids = [int(sku_id) for sku_id in sku_ids]
+    if not sku_ids:
+        return {}
+    if conn is None:
+        conn = get_redis_connection('default')
+
+    stocks = {}
+    missing = []
+    for sku_id, stock in zip(sku_ids, conn.hmget(SKU_STOCK_KEY, sku_ids)):
+        if stock is None:
+            missing.append(sku_id)
+        else:
+            stocks[sku_id] = int(stock)
+    if missing:
+        stocks.update(load_stocks(missing, conn))
+    return stocks
+
+
+def set_stocks(stocks, conn=None):
+    """库存变化后写入缓存，stocks为{商品id: 库存}"""
+    if not stocks:
+        return
+    if conn is None:
+        conn = get_redis_connection('default')
+    conn.hmset(SKU_STOCK_KEY, stocks)
+
+
+def decr_stocks(counts, conn=None):
+    """订单提交后减少缓存的库存，counts为{商品id: 购买数量}"""
+    if not counts:
+        return
+    if conn is None:
+        conn = get_redis_connection('default')
+    args = []
+    for sku_id, count in counts.items():
+        args.extend([sku_id, count])
+    conn.register_script(DECR_STOCKS_SCRIPT)(keys=[SKU_STOCK_KEY], args=args)
+
+
+def incr_stocks(counts, conn=None):
+    """订单取消后增加缓存的库存，counts为{商品id: 归还数量}"""
+    decr_stocks({sku_id: -count for sku_id, count in counts.items()}, conn)
+
+
+def sell_stocks(counts):
+    """在数据库中减少库存、增加销量，counts为{商品id: 购买数量}
+
+    一条update语句更新所有商品，条件中校验库存，并发下单时不会超卖
+    update df_goods_sku set stock=stock-case id when ... end, sales=sales+case id when ... end
+    where id in (...) and stock >= case id when ... end
+    按主键顺序加行锁，多个订单同时提交时不会死锁
+    返回受影响的行数，小于商品数说明有商品库存不足
+    """
+    count_case = Case(*[When(id=sku_id, then=Value(count)) for sku_id, count in counts.items()],
+                      output_field=IntegerField())
+    return GoodsSKU.objects.filter(id__in=list(counts), stock__gte=count_case) \
+        .update(stock=F('stock') - count_case, sales=F('sales') + count_case)
+
+
+def return_stocks(counts):
+    """订单取消后在数据库中归还库存、减少销量，counts为{商品id: 归还数量}
+
+    与sell_stocks相同，一条update语句更新所有商品，调用者需要保证同一个订单只归还一次
+    返回受影响的行数
+    """
+    count_case = Case(*[When(id=sku_id, then=Value(count)) for sku_id, count in counts.items()],
+                      output_field=IntegerField())
+    return GoodsSKU.objects.filter(id__in=list(counts)) \
+        .update(stock=F('stock') + count_case, sales=F('sales') - count_case)
+
+
+def reconcile_stocks(conn=None, batch_size=500):
+    """用数据库中的库存修正已缓存的库存，删除已不存在的商品，返回修正的商品数"""
+    if conn is None:
+        conn = get_redis_connection('default')
+    sku_ids = [int(sku_id) for sku_id in conn.hkeys(SKU_STOCK_KEY)]
+    changed = 0
+    for start in range(0, len(sku_ids), batch_size):
+        batch = sku_ids[start:start + batch_size]
+        stocks = dict(GoodsSKU.objects.filter(id__in=batch).values_list('id', 'stock'))
+        cached = conn.hmget(SKU_STOCK_KEY, batch)
+        stale = {sku_id: stocks[sku_id] for sku_id, stock in zip(batch, cached)
+                 if sku_id in stocks and (stock is None or int(stock) != stocks[sku_id])}
+        deleted = [sku_id for sku_id in batch if sku_id not in stocks]
+        pipe = conn.pipeline()
+        if stale:
+            pipe.hmset(SKU_STOCK_KEY, stale)
+        if deleted:
+            pipe.hdel(SKU_STOCK_KEY, *deleted)
+        pipe.execute()
+        changed += len(stale) + len(deleted)
+    return changed
+
+
+def remove_stocks(sku_ids, conn=None):
+    """商品删除后清除库存缓存"""
+    if conn is None:
+        conn = get_redis_connection('default')
+    conn.hdel(SKU_STOCK_KEY, *sku_ids)
@@ -1,3 +1,46 @@
 from django.test import TestCase
+from goods.models import GoodsType, Goods, GoodsSKU
+from goods.list_page import _seek, LIST_PAGE_SIZE
 
 # Create your tests here.
+
+
+class SeekTest(TestCase):
+    """列表页按游标翻页"""
+    def setUp(self):
+        goods_type = GoodsType.objects.create(name='水果', logo='fruit', image='type/fruit.jpg')
+        goods = Goods.objects.create(name='苹果')
+        # 价格和销量有重复值，相同值按id排序
+        for i in range(23):
+            GoodsSKU.objects.create(type=goods_type, goods=goods, name='苹果%d' % i, desc='', unite='500g',
+                                    image='goods/apple.jpg', price=10 + i % 4, sales=i % 5, stock=10)
+        self.skus = GoodsSKU.objects.filter(type=goods_type)
+
+    def expected_order(self, field, desc):
+        """按(排序字段, id)排序的全部商品id"""
+        skus = list(self.skus)
+        if field == 'id':
+            skus.sort(key=lambda sku: sku.id, reverse=desc)
+        else:
+            skus.sort(key=lambda sku: (getattr(sku, field), sku.id), reverse=desc)
+        return [sku.id for sku in skus]
+
+    def check(self, field, desc):
+        ids = self.expected_order(field, desc)
+        for i, cursor_id in enumerate(ids):
+            after = [sku.id for sku in _seek(self.skus, field, desc, cursor_id, True)]
+            self.assertEqual(after, ids[i + 1:i + 1 + LIST_PAGE_SIZE])
+            before = [sku.id for sku in _seek(self.skus, field, desc, cursor_id, False)]
+            self.assertEqual(before, ids[max(i - LIST_PAGE_SIZE, 0):i])
+
+    def test_default_order(self):
+        self.check('id', True)
+
+    def test_price_order(self):
+        self.check('price', False)
+
+    def test_sales_order(self):
+        self.check('sales', True)
+
+    def test_missing_cursor(self):
+        self.assertIsNone(_seek(self.skus, 'id', True, 0, True))
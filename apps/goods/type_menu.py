@@ -0,0 +1,45 @@
+import time
+from django.conf import settings
+from django_redis import get_redis_connection
+from goods.models import GoodsType
+
+# 商品种类的版本号，后台修改商品种类时加1
+TYPE_MENU_VERSION_KEY = 'goods_type_version'
+
+# 当前worker进程中缓存的(版本号, 商品种类列表, 上次检查版本号的时间)
+_type_menu = (None, None, 0)
+
+
+def bump_type_menu_version():
+    """商品种类发生变化，通知所有worker重新加载"""
+    conn = get_redis_connection('default')
+    conn.incr(TYPE_MENU_VERSION_KEY)
+
+
+def get_type_menu():
+    """获取商品种类列表，使用进程内缓存
+
+    检查间隔内直接返回进程内的列表，超过间隔只读取redis中的版本号，
+    版本号变化时才查询数据库
+    """
+    global _type_menu
+    version, types, checked = _type_menu
+    now = time.time()
+    if types is not None and now - checked < settings.TYPE_MENU_CHECK_INTERVAL:
+        return types
+
+    conn = get_redis_connection('default')
+    current = conn.get(TYPE_MENU_VERSION_KEY)
+    if types is None or current != version:
+        types = list(GoodsType.objects.all())
+    # 整体替换元组，多线程下不会读到不一致的状态
+    _type_menu = (current, types, now)
+    return types
+
+
+def get_type(type_id):
+    """从种类列表中查找种类，不存在时返回None"""
+    for type in get_type_menu():
+        if type.id == int(type_id):
+            return type
+    return None
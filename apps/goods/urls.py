@@ -1,9 +1,10 @@
 from django.conf.urls import url
-from goods.views import IndexView, DetailView, ListView
+from goods.views import IndexView, DetailView, ListView, CommentListView
 
 
 urlpatterns = [
     url(r'^index$', IndexView.as_view(), name="index"),  # 首页
     url(r'^goods/(?P<goods_id>\d+)$', DetailView.as_view(), name='detail'),  # 详情页
+    url(r'^goods/(?P<goods_id>\d+)/comments$', CommentListView.as_view(), name='comments'),  # 更早的商品评论
     url(r'^list/(?P<type_id>\d+)/(?P<page>\d+)$',  ListView.as_view(), name='list'),  # 列表页
 ]
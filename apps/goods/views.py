@@ -1,11 +1,19 @@
 from django.shortcuts import render, redirect
 from django.core.urlresolvers import reverse
 from django.views.generic import View
-from goods.models import GoodsType, IndexGoodsBanner, IndexPromotionBanner, IndexTypeGoodsBanner, GoodsSKU
+from goods.models import GoodsSKU
+from goods.type_menu import get_type_menu, get_type
+from goods.index_page import get_index_page_data
+from goods.detail_page import get_detail_page_data
+from goods.list_page import get_list_page
 from django_redis import get_redis_connection
 from django.core.cache import cache
-from order.models import OrderGoods
-from django.core.paginator import Paginator
+from django.http import JsonResponse
+from django.conf import settings
+from django.utils.dateparse import parse_datetime
+from order.reviews import get_older_reviews, format_review_time
+from user.history import record_history
+from cart.storage import remember_cart_count
 # Create your views here.
 
 
@@ -15,47 +23,13 @@ class IndexView(View):
         # 尝试从缓存中获取数据
         context = cache.get('index_page_data')
         if context is None:
-
-            # 获取商品的种类信息
-            types = GoodsType.objects.all()
-
-            # 获取首页轮播商品信息
-            goods_banners = IndexGoodsBanner.objects.all().order_by('index')
-
-            # 获取首页促销活动信息
-            promotion_banners = IndexPromotionBanner.objects.all().order_by('index')
-
-            # 获取首页分类商品信息
-            # type_goods_banners = IndexTypeGoodsBanner.objects.all()
-            for type in types:
-                # 获取type种类首页分类商品的图片展示信息
-                image_banners = IndexTypeGoodsBanner.objects.filter(type=type, display_type=1).order_by('index')
-                # 获取type种类首页分类商品的文字展示信息
-                title_banners = IndexTypeGoodsBanner.objects.filter(type=type, display_type=0).order_by('index')
-                # 动态增加type属性，分别保存首页分类商品的图片信息和文字信息
-                type.image_banners = image_banners
-                type.title_banners = title_banners
-
-            context = {'types': types,
-                       'goods_banners': goods_banners,
-                       'promotion_banners': promotion_banners}
+            # 缓存中没有数据，查询数据库
+            context = get_index_page_data()
 
             # 设置缓存
             cache.set('index_page_data', context, 3600)
 
-        # 获取用户购物车中商品的数目
-        user = request.user
-        cart_count = 0
-        if user.is_authenticated():
-            # 用户已登录
-            conn = get_redis_connection('default')
-            cart_key = 'cart_%d' % user.id
-            cart_count = conn.hlen(cart_key)
-        print(cart_count)
-
-        # 组织模板上下文
-        context.update(cart_count=cart_count)
-
+        # 购物车条目数由context processor提供
         return render(request, 'index.html', context)
 
 
@@ -64,53 +38,59 @@ class DetailView(View):
     """详情页"""
     def get(self, request, goods_id):
         """显示详情页"""
-        try:
-            sku = GoodsSKU.objects.get(id=goods_id)
-        except GoodsSKU.DoesNotExist:
+        # 获取与用户无关的详情页数据，优先使用缓存
+        context = get_detail_page_data(goods_id)
+        if context is None:
             # 商品不存在
             return redirect(reverse('goods:index'))
-        # 获取商品的分类信息
-        types = GoodsType.objects.all()
-
-        # 获取商品的评论信息
-        sku_orders = OrderGoods.objects.filter(sku=sku).exclude(comment='')
 
-        # 获取新品信息
-        new_skus = GoodsSKU.objects.filter(type=sku.type).order_by('-create_time')[:2]
-
-        # 获取同一SPU的其他规格的商品
-        same_spu_skus = GoodsSKU.objects.filter(goods=sku.goods).exclude(id=goods_id)
+        # 获取商品的分类信息，使用进程内缓存
+        context = dict(context, types=get_type_menu())
 
-        # 获取用户购物车中商品的数目
         user = request.user
-        cart_count = 0
         if user.is_authenticated():
             # 用户已登录
+            # 添加用户的历史浏览记录，同时获取购物车条目数，只访问一次redis
             conn = get_redis_connection('default')
-            cart_key = 'cart_%d' % user.id
-            cart_count = conn.hlen(cart_key)
-
-            # 添加用户的历史浏览记录
-            conn = get_redis_connection('default')
-            history_key = 'history_%d' % user.id
-            # 移除列表中的goods_id
-            conn.lrem(history_key, 0, goods_id)
-            # 把goods_id插入列表左侧
-            conn.lpush(history_key, goods_id)
-            # 只保存用户最新的5次浏览记录
-            conn.ltrim(history_key, 0, 4)
-
-        # 组织模板上下文
-        context = {'sku': sku, 'types': types,
-                   'sku_orders': sku_orders,
-                   'new_skus': new_skus,
-                   'same_spu_skus': same_spu_skus,
-                   'cart_count': cart_count}
+            remember_cart_count(request, record_history(conn, user.id, goods_id))
 
         # 使用模板
         return render(request, 'detail.html', context)
 
 
+# ajax get
+# 前端传递的参数：最后一条评论的时间(before_time)和id(before_id)
+# /goods/商品id/comments
+class CommentListView(View):
+    """加载更早的商品评论"""
+    def get(self, request, goods_id):
+        # 接收参数
+        try:
+            before_time = parse_datetime(request.GET.get('before_time', ''))
+        except Exception as e:
+            # 格式正确但日期无效
+            before_time = None
+        try:
+            before_id = int(request.GET.get('before_id'))
+        except Exception as e:
+            before_id = None
+
+        # 校验参数
+        if before_time is None or before_id is None:
+            return JsonResponse({'res': 0, 'errmsg': '参数错误'})
+
+        # 多查一条，判断是否还有更早的评论
+        limit = settings.REVIEW_LATEST_COUNT
+        reviews = get_older_reviews(goods_id, before_time, before_id, limit + 1)
+        has_more = len(reviews) > limit
+        reviews = reviews[:limit]
+        for review in reviews:
+            review['time_display'] = format_review_time(parse_datetime(review['time']))
+
+        # 返回应答
+        return JsonResponse({'res': 1, 'reviews': reviews, 'has_more': has_more})
+
+
 # 种类id 页码 排序方式
 # restful api -> 请求一种资源
 # /list?type_id=种类id&page=页码&sort=排序方式
@@ -120,46 +100,42 @@ class ListView(View):
     """列表页"""
     def get(self, request, type_id, page):
         """显示"""
+        # 获取商品的分类信息，使用进程内缓存
+        types = get_type_menu()
+
         # 获取种类信息
-        try:
-            type = GoodsType.objects.get(id=type_id)
-        except GoodsType.DoesNotExist:
+        type = get_type(type_id)
+        if type is None:
             return redirect(reverse('goods:index'))
 
-        # 获取商品的分类信息
-        types = GoodsType.objects.all()
-
         # 获取排序的方式
         # sort=default 按照默认id显示
         # sort=price 按照商品价格排序
         # sort=hot 按照商品销量排序
         sort = request.GET.get('sort')
-        # 获取商品的分类信息
-        if sort == 'price':
-            skus = GoodsSKU.objects.filter(type=type).order_by('price')
-        elif sort == 'hot':
-            skus = GoodsSKU.objects.filter(type=type).order_by('-sales')
-        else:
+        if sort not in ('price', 'hot'):
             sort = 'default'
-            skus = GoodsSKU.objects.filter(type=type).order_by('-id')
-
-        # 对数据进行分页
-        paginator = Paginator(skus, 5)
 
         # 获取第page页内容
         try:
             page = int(page)
-
         except Exception as e:
             page = 1
 
-        if page > paginator.num_pages:
-            page = 1
+        # 翻页时带上上一页最后一个或下一页第一个商品的id，直接定位，深页和第一页代价相同
+        try:
+            after = int(request.GET['after'])
+        except Exception as e:
+            after = None
+        try:
+            before = int(request.GET['before'])
+        except Exception as e:
+            before = None
 
-        # 获取第page页的Page实例对象
-        skus_page = paginator.page(page)
-        #for sku1 in skus_page:
-         #   print(sku1.price)
+        # 获取第page页的Page实例对象，商品总数使用缓存
+        skus_page = get_list_page(type.id, sort, page, after=after, before=before)
+        paginator = skus_page.paginator
+        page = skus_page.number
 
         # 进行页码的控制，页面上最多显示5个页码
         # 1.总页数小于5页，页面上显示所有页码
@@ -179,21 +155,11 @@ class ListView(View):
         # 获取新品信息
         new_skus = GoodsSKU.objects.filter(type=type).order_by('-create_time')[:2]
 
-        # 获取用户购物车中商品的数目
-        user = request.user
-        cart_count = 0
-        if user.is_authenticated():
-            # 用户已登录
-            conn = get_redis_connection('default')
-            cart_key = 'cart_%d' % user.id
-            cart_count = conn.hlen(cart_key)
-
         # 组织模板上下文
         context = {'type': type, 'types': types,
                    'skus_page': skus_page,
                    'new_skus': new_skus,
                    'pages': pages,
-                   'cart_count': cart_count,
                    'sort': sort}
 
         # 使用模板
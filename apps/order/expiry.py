@@ -0,0 +1,99 @@
+import time
+from collections import defaultdict
+from django.conf import settings
+from django.db import transaction
+from django_redis import get_redis_connection
+from goods.models import GoodsSKU
+from goods.stock import return_stocks, incr_stocks
+from goods.sku_snapshot import invalidate_sku_snapshots
+from goods.rankings import incr_sales_rankings
+from order.models import OrderInfo, OrderGoods
+from order.flash_sale import release_flash_sale
+
+# 待支付订单的有序集合，member为订单id，score为支付截止时间戳
+# 只需要处理score小于当前时间的订单，每次的开销只与到期的订单数有关
+ORDER_EXPIRY_KEY = 'order_expiry'
+# 同一时间只有一个任务在取消订单
+ORDER_EXPIRY_LOCK_KEY = 'order_expiry_lock'
+
+# 货到付款的订单不需要在线支付，不会过期
+OFFLINE_PAY_METHODS = ('1', 1)
+
+
+def schedule_order_expiry(order_id, pay_method, conn=None):
+    """订单创建后登记支付截止时间"""
+    if pay_method in OFFLINE_PAY_METHODS:
+        return
+    if conn is None:
+        conn = get_redis_connection('default')
+    conn.execute_command('ZADD', ORDER_EXPIRY_KEY, time.time() + settings.ORDER_PAY_TIMEOUT, order_id)
+
+
+def cancel_order_expiry(order_id, conn=None):
+    """订单已支付，不再需要取消"""
+    if conn is None:
+        conn = get_redis_connection('default')
+    conn.zrem(ORDER_EXPIRY_KEY, order_id)
+
+
+def _cancel_orders(order_ids):
+    """取消仍然待支付的订单并归还库存，返回(取消的订单id, {商品id: 归还数量})"""
+    with transaction.atomic():
+        # 锁住待支付的订单，与支付确认互斥，已支付的订单不会被取消
+        order_ids = list(OrderInfo.objects.select_for_update()
+                         .filter(order_id__in=order_ids, order_status=1).values_list('order_id', flat=True))
+        if not order_ids:
+            return [], {}
+        OrderInfo.objects.filter(order_id__in=order_ids).update(order_status=6)  # 已取消
+
+        counts = defaultdict(int)
+        for sku_id, count in OrderGoods.objects.filter(order_id__in=order_ids).values_list('sku_id', 'count'):
+            counts[sku_id] += count
+        if counts:
+            return_stocks(counts)
+    return order_ids, dict(counts)
+
+
+def expire_unpaid_orders(batch_size=None, conn=None):
+    """取消超过支付期限的订单，返回取消的订单数
+
+    已经有任务在取消订单时直接返回0，不等待锁，执行较慢时后续的定时任务不会堆积
+    """
+    # order.payment引用了本模块，在函数中导入
+    from order.payment import PAY_POLLING_KEY
+    if batch_size is None:
+        batch_size = settings.ORDER_EXPIRY_BATCH_SIZE
+    if conn is None:
+        conn = get_redis_connection('default')
+
+    canceled = 0
+    lock = conn.lock(ORDER_EXPIRY_LOCK_KEY, timeout=300)
+    if not lock.acquire(blocking=False):
+        return canceled
+    try:
+        while True:
+            due = conn.zrangebyscore(ORDER_EXPIRY_KEY, '-inf', time.time(), start=0, num=batch_size)
+            if not due:
+                break
+            due = [order_id.decode() for order_id in due]
+            order_ids, returned = _cancel_orders(due)
+            canceled += len(order_ids)
+            if order_ids:
+                # 停止轮询已取消订单的支付结果，已调度的轮询任务查到订单已取消后结束
+                conn.delete(*[PAY_POLLING_KEY % order_id for order_id in order_ids])
+
+            if returned:
+                # 库存发生变化，更新库存缓存、秒杀库存、商品快照和人气排序
+                incr_stocks(returned, conn)
+                release_flash_sale(conn, returned)
+                invalidate_sku_snapshots(list(returned), conn)
+                type_ids = dict(GoodsSKU.objects.filter(id__in=list(returned)).values_list('id', 'type_id'))
+                incr_sales_rankings([(type_ids[sku_id], sku_id, -count)
+                                     for sku_id, count in returned.items() if sku_id in type_ids])
+            # 已支付或已取消的订单都从有序集合中删除
+            conn.zrem(ORDER_EXPIRY_KEY, *due)
+            if len(due) < batch_size:
+                break
+    finally:
+        lock.release()
+    return canceled
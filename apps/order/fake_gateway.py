@@ -0,0 +1,97 @@
+import json
+import threading
+import time
+from base64 import b64encode
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import urlparse, parse_qs
+from Cryptodome.Hash import SHA256
+from Cryptodome.PublicKey import RSA
+from Cryptodome.Signature import PKCS1_v1_5
+
+
+class FakeAlipayGateway(object):
+    """本地模拟的支付宝网关，用于压测和测试
+
+    只实现电脑网站支付和交易查询，不校验请求的签名，响应使用自己生成的密钥签名，
+    客户端需要用write_public_key写出的公钥验签
+    交易在第一次查询pay_after秒之后变为支付成功，之前返回等待付款
+    """
+    def __init__(self, host='127.0.0.1', port=0, pay_after=0):
+        self.key = RSA.generate(2048)
+        self.pay_after = pay_after
+        self._first_query = {}
+        self._lock = threading.Lock()
+        self.server = _ThreadingHTTPServer((host, port), _GatewayHandler)
+        self.server.gateway = self
+        self._thread = None
+
+    @property
+    def url(self):
+        return 'http://%s:%d/gateway.do' % self.server.server_address[:2]
+
+    def write_public_key(self, path):
+        with open(path, 'wb') as f:
+            f.write(self.key.publickey().exportKey())
+
+    def sign(self, content):
+        signature = PKCS1_v1_5.new(self.key).sign(SHA256.new(content.encode('utf8')))
+        return b64encode(signature).decode()
+
+    def trade_query(self, order_id):
+        """交易查询接口的响应内容"""
+        with self._lock:
+            first = self._first_query.setdefault(order_id, time.time())
+        paid = time.time() - first >= self.pay_after
+        response = {'code': '10000', 'msg': 'Success', 'out_trade_no': order_id,
+                    'trade_status': 'TRADE_SUCCESS' if paid else 'WAIT_BUYER_PAY'}
+        if paid:
+            response['trade_no'] = 'FAKE%s' % order_id
+        return response
+
+    def handle(self, params):
+        """处理网关请求，返回(content_type, body)"""
+        method = params.get('method')
+        if method == 'alipay.trade.query':
+            biz_content = json.loads(params['biz_content'])
+            content = json.dumps(self.trade_query(biz_content['out_trade_no']))
+            body = '{"alipay_trade_query_response":%s,"sign":"%s"}' % (content, self.sign(content))
+            return 'application/json;charset=utf-8', body
+        # 电脑网站支付，显示收银台页面
+        return 'text/html;charset=utf-8', '<h1>模拟支付宝收银台</h1><p>%s</p>' % params.get('biz_content', '')
+
+    def start(self):
+        """在后台线程中启动网关"""
+        self._thread = threading.Thread(target=self.server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        self.server.serve_forever()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _GatewayHandler(BaseHTTPRequestHandler):
+    # 使用长连接，客户端可以复用连接
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        params = {key: values[0] for key, values in parse_qs(urlparse(self.path).query).items()}
+        content_type, body = self.server.gateway.handle(params)
+        body = body.encode('utf8')
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
@@ -0,0 +1,199 @@
+from django.conf import settings
+from django.db import transaction
+from django_redis import get_redis_connection
+from goods.models import GoodsSKU
+from goods.stock import sell_stocks, decr_stocks
+from goods.sku_snapshot import invalidate_sku_snapshots
+from goods.rankings import incr_sales_rankings
+from order.models import OrderInfo, OrderGoods
+from cart.storage import cart_key, cart_total_key
+
+# 秒杀商品的库存，field为商品id，value为剩余可预留的库存
+# 商品在这个hash中即表示处于秒杀模式，开始秒杀时从数据库预加载
+FLASH_SALE_STOCK_KEY = 'flash_sale_stock'
+
+# 秒杀订单的状态
+FLASH_ORDER_QUEUED = 'queued'
+FLASH_ORDER_CREATED = 'created'
+FLASH_ORDER_FAILED = 'failed'
+
+# 预留库存的结果
+FLASH_RESERVE_OK = 1
+FLASH_RESERVE_NO_STOCK = 0
+FLASH_RESERVE_NOT_FLASH = -1
+FLASH_RESERVE_NO_CART = -2
+
+# 原子地预留订单中所有商品的库存，从购物车中删除对应的记录，并记录订单状态为排队中
+# 购物车记录与预留同时删除，重复提交时购物车中已经没有这些商品，不会重复下单
+# KEYS[1]: 秒杀库存  KEYS[2]: flash_order_订单id  KEYS[3]: cart_用户id  KEYS[4]: cart_total_用户id
+# ARGV[1]: 用户id  ARGV[2]: 订单状态的过期时间  ARGV[3:]: 每两个一组，商品id、数量
+RESERVE_SCRIPT = """
+for i = 3, #ARGV, 2 do
+    if redis.call('hget', KEYS[3], ARGV[i]) ~= ARGV[i + 1] then
+        return -2
+    end
+    local stock = redis.call('hget', KEYS[1], ARGV[i])
+    if not stock then
+        return -1
+    end
+    if tonumber(stock) < tonumber(ARGV[i + 1]) then
+        return 0
+    end
+end
+local removed = 0
+for i = 3, #ARGV, 2 do
+    redis.call('hincrby', KEYS[1], ARGV[i], -tonumber(ARGV[i + 1]))
+    redis.call('hdel', KEYS[3], ARGV[i])
+    removed = removed + tonumber(ARGV[i + 1])
+end
+if redis.call('exists', KEYS[4]) == 1 then
+    redis.call('decrby', KEYS[4], removed)
+end
+redis.call('hmset', KEYS[2], 'user', ARGV[1], 'status', 'queued')
+redis.call('expire', KEYS[2], ARGV[2])
+return 1
+"""
+
+# 订单写入数据库失败时归还预留的库存，秒杀已结束的商品不再归还
+# 传入购物车的key时把商品放回购物车
+# KEYS[1]: 秒杀库存  KEYS[2]: cart_用户id  KEYS[3]: cart_total_用户id
+# ARGV: 每两个一组，商品id、数量
+RELEASE_SCRIPT = """
+local added = 0
+for i = 1, #ARGV, 2 do
+    if redis.call('hexists', KEYS[1], ARGV[i]) == 1 then
+        redis.call('hincrby', KEYS[1], ARGV[i], ARGV[i + 1])
+    end
+    if KEYS[2] then
+        redis.call('hincrby', KEYS[2], ARGV[i], ARGV[i + 1])
+        added = added + tonumber(ARGV[i + 1])
+    end
+end
+if KEYS[3] and redis.call('exists', KEYS[3]) == 1 then
+    redis.call('incrby', KEYS[3], added)
+end
+return 1
+"""
+
+
+class FlashSaleError(Exception):
+    pass
+
+
+def flash_order_key(order_id):
+    return 'flash_order_%s' % order_id
+
+
+def _pairs(counts):
+    args = []
+    for sku_id, count in counts.items():
+        args.extend([sku_id, count])
+    return args
+
+
+def start_flash_sale(sku_ids, conn=None):
+    """商品进入秒杀模式，从数据库预加载库存，返回{商品id: 库存}"""
+    if conn is None:
+        conn = get_redis_connection('default')
+    stocks = dict(GoodsSKU.objects.filter(id__in=sku_ids).values_list('id', 'stock'))
+    if stocks:
+        conn.hmset(FLASH_SALE_STOCK_KEY, stocks)
+    return stocks
+
+
+def stop_flash_sale(sku_ids, conn=None):
+    """商品退出秒杀模式，排队中的订单仍会写入数据库"""
+    if conn is None:
+        conn = get_redis_connection('default')
+    conn.hdel(FLASH_SALE_STOCK_KEY, *sku_ids)
+
+
+def get_flash_sale_skus(sku_ids, conn):
+    """返回sku_ids中处于秒杀模式的商品id集合"""
+    sku_ids = [int(sku_id) for sku_id in sku_ids]
+    return {sku_id for sku_id, stock in zip(sku_ids, conn.hmget(FLASH_SALE_STOCK_KEY, sku_ids))
+            if stock is not None}
+
+
+def reserve_flash_sale(conn, order_id, user_id, counts):
+    """预留秒杀商品的库存，counts为{商品id: 数量}
+
+    counts需要与购物车中的数量一致，预留成功时从购物车中删除这些商品
+    返回FLASH_RESERVE_OK、FLASH_RESERVE_NO_STOCK、FLASH_RESERVE_NOT_FLASH或FLASH_RESERVE_NO_CART
+    """
+    script = conn.register_script(RESERVE_SCRIPT)
+    return script(keys=[FLASH_SALE_STOCK_KEY, flash_order_key(order_id), cart_key(user_id), cart_total_key(user_id)],
+                  args=[user_id, settings.FLASH_SALE_ORDER_TTL] + _pairs(counts))
+
+
+def release_flash_sale(conn, counts, user_id=None):
+    """归还预留的库存，传入user_id时把商品放回该用户的购物车"""
+    keys = [FLASH_SALE_STOCK_KEY]
+    if user_id is not None:
+        keys += [cart_key(user_id), cart_total_key(user_id)]
+    conn.register_script(RELEASE_SCRIPT)(keys=keys, args=_pairs(counts))
+
+
+def set_flash_order_status(conn, order_id, status, errmsg=''):
+    pipe = conn.pipeline()
+    pipe.hmset(flash_order_key(order_id), {'status': status, 'errmsg': errmsg})
+    pipe.expire(flash_order_key(order_id), settings.FLASH_SALE_ORDER_TTL)
+    pipe.execute()
+
+
+def get_flash_order_status(conn, order_id, user_id):
+    """获取秒杀订单的状态，返回(状态, 错误信息)，订单不存在或不属于该用户时返回None"""
+    data = conn.hgetall(flash_order_key(order_id))
+    data = {k.decode(): v.decode() for k, v in data.items()}
+    if data.get('user') != str(user_id):
+        return None
+    return data['status'], data.get('errmsg', '')
+
+
+def persist_flash_sale_order(order_id, user_id, addr_id, pay_method, transit_price, counts):
+    """把已预留库存的秒杀订单写入数据库，由celery任务调用，返回是否成功
+
+    同一个订单重复执行时不会重复下单，失败时归还预留的库存
+    """
+    conn = get_redis_connection('default')
+    counts = {int(sku_id): int(count) for sku_id, count in counts.items()}
+    # 开始处理时重新计时，排队时间较长的订单状态在处理期间不会过期
+    conn.expire(flash_order_key(order_id), settings.FLASH_SALE_ORDER_TTL)
+    if OrderInfo.objects.filter(order_id=order_id).exists():
+        set_flash_order_status(conn, order_id, FLASH_ORDER_CREATED)
+        return True
+
+    try:
+        with transaction.atomic():
+            skus = list(GoodsSKU.objects.filter(id__in=list(counts)).order_by('id'))
+            if len(skus) != len(counts):
+                raise FlashSaleError('商品不存在')
+            total_count = sum(counts.values())
+            total_price = sum(sku.price * counts[sku.id] for sku in skus)
+            order = OrderInfo.objects.create(order_id=order_id, user_id=user_id,
+                                             addr_id=addr_id, pay_method=pay_method,
+                                             total_count=total_count, total_price=total_price,
+                                             transit_price=transit_price)
+            # 预留时已经校验过秒杀库存，数据库中仍然校验，防止后台修改库存后超卖
+            if sell_stocks(counts) != len(skus):
+                raise FlashSaleError('商品库存不足')
+            OrderGoods.objects.bulk_create([OrderGoods(order=order, sku=sku, count=counts[sku.id], price=sku.price)
+                                            for sku in skus])
+    except FlashSaleError as e:
+        release_flash_sale(conn, counts, user_id)
+        set_flash_order_status(conn, order_id, FLASH_ORDER_FAILED, str(e))
+        return False
+    except Exception:
+        release_flash_sale(conn, counts, user_id)
+        set_flash_order_status(conn, order_id, FLASH_ORDER_FAILED, '下单失败')
+        raise
+
+    # 与普通下单相同，更新库存缓存、商品快照和人气排序，购物车记录在预留时已经删除
+    decr_stocks(counts, conn)
+    invalidate_sku_snapshots(list(counts), conn)
+    incr_sales_rankings([(sku.type_id, sku.id, counts[sku.id]) for sku in skus])
+    # order.expiry引用了本模块，在函数中导入
+    from order.expiry import schedule_order_expiry
+    schedule_order_expiry(order_id, pay_method, conn)
+    set_flash_order_status(conn, order_id, FLASH_ORDER_CREATED)
+    return True
@@ -0,0 +1,50 @@
+import os
+import tempfile
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from alipay import AliPay
+from order.fake_gateway import FakeAlipayGateway
+from order.payment import PaymentGateway
+
+
+class Command(BaseCommand):
+    help = '使用本地模拟网关，比较每次创建AliPay对象与复用支付宝接口客户端的耗时'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200)
+
+    def handle(self, *args, **options):
+        n = options['requests']
+        gateway = FakeAlipayGateway().start()
+        fd, public_key_path = tempfile.mkstemp(suffix='.pem')
+        os.close(fd)
+        try:
+            gateway.write_public_key(public_key_path)
+
+            def new_alipay():
+                # 修改前每个请求的做法：创建对象时读取并解析密钥
+                alipay = AliPay(appid=settings.ALIPAY_APPID, app_notify_url=settings.ALIPAY_NOTIFY_URL,
+                                app_private_key_path=settings.ALIPAY_APP_PRIVATE_KEY_PATH,
+                                alipay_public_key_path=public_key_path, sign_type='RSA2', debug=True)
+                alipay._gateway = gateway.url
+                return alipay
+
+            def page_pay(alipay):
+                alipay.api_alipay_trade_page_pay(out_trade_no='bench', total_amount='10.00', subject='bench')
+
+            client = PaymentGateway(gateway_url=gateway.url, alipay_public_key_path=public_key_path)
+            cases = [
+                ('支付页 每次创建', lambda i: page_pay(new_alipay())),
+                ('支付页 复用客户端', lambda i: client.page_pay_url('bench', '10.00', 'bench')),
+                ('查询 每次创建', lambda i: new_alipay().api_alipay_trade_query('bench%d' % i)),
+                ('查询 复用客户端', lambda i: client.query('bench%d' % i)),
+            ]
+            for name, func in cases:
+                start = time.time()
+                for i in range(n):
+                    func(i)
+                self.stdout.write('%s：平均%.2fms' % (name, (time.time() - start) * 1000 / n))
+        finally:
+            gateway.stop()
+            os.remove(public_key_path)
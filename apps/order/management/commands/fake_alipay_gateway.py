@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from order.fake_gateway import FakeAlipayGateway
+
+
+class Command(BaseCommand):
+    help = '启动本地模拟的支付宝网关，用于压测和测试'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--port', type=int, default=8800)
+        parser.add_argument('--pay-after', type=float, default=0,
+                            help='第一次查询多少秒之后交易变为支付成功')
+        parser.add_argument('--public-key', default='fake_alipay_public_key.pem',
+                            help='写出网关公钥的路径，ALIPAY_PUBLIC_KEY_PATH需要指向这个文件')
+
+    def handle(self, *args, **options):
+        gateway = FakeAlipayGateway(port=options['port'], pay_after=options['pay_after'])
+        gateway.write_public_key(options['public_key'])
+        self.stdout.write('模拟网关地址：%s，公钥：%s' % (gateway.url, options['public_key']))
+        self.stdout.write('设置ALIPAY_GATEWAY_URL和ALIPAY_PUBLIC_KEY_PATH后使用')
+        try:
+            gateway.serve_forever()
+        except KeyboardInterrupt:
+            gateway.server.server_close()
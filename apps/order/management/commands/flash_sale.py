@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from order.flash_sale import start_flash_sale, stop_flash_sale
+
+
+class Command(BaseCommand):
+    help = '商品进入或退出秒杀模式'
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=['start', 'stop'])
+        parser.add_argument('sku_ids', nargs='+', type=int)
+
+    def handle(self, *args, **options):
+        if options['action'] == 'start':
+            stocks = start_flash_sale(options['sku_ids'])
+            self.stdout.write('开始秒杀，共%d个商品，库存%s' % (len(stocks), stocks))
+        else:
+            stop_flash_sale(options['sku_ids'])
+            self.stdout.write('结束秒杀，共%d个商品' % len(options['sku_ids']))
@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('order', '0002_auto_20190923_1829'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='ordergoods',
+            index_together=set([('sku', 'update_time')]),
+        ),
+    ]
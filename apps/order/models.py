@@ -22,7 +22,8 @@ class OrderInfo(BaseModel):
         "UNSEND": 2,
         "UNRECEIVED": 3,
         "UNCOMMENT": 4,
-        "FINISHED": 5
+        "FINISHED": 5,
+        "CANCELED": 6
     }
 
     PAY_METHOD_CHOICES = (
@@ -37,7 +38,8 @@ class OrderInfo(BaseModel):
         2: '待发货',
         3: '待收货',
         4: '待评价',
-        5: '已完成'
+        5: '已完成',
+        6: '已取消'
     }
 
     ORDER_STATUS_CHOICES = (
@@ -45,7 +47,8 @@ class OrderInfo(BaseModel):
         (2, '待发货'),
         (3, '待收货'),
         (4, '待评价'),
-        (5, '已完成')
+        (5, '已完成'),
+        (6, '已取消')
     )
 
     order_id = models.CharField(max_length=128, primary_key=True, verbose_name='订单id')
@@ -75,4 +78,6 @@ class OrderGoods(BaseModel):
     class Meta:
         db_table = 'df_order_goods'
         verbose_name = '订单商品'
-        verbose_name_plural = verbose_name
\ No newline at end of file
+        verbose_name_plural = verbose_name
+        # 按商品查询评论并按评论时间排序、分页
+        index_together = [('sku', 'update_time')]
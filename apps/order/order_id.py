@@ -0,0 +1,64 @@
+import os
+import threading
+import time
+from datetime import datetime
+from django_redis import get_redis_connection
+
+# 订单id格式：年月日时分秒(14位) + 毫秒(3位) + 机器号(4位) + 序号(4位)，共25位
+# 与原来的 年月日时分秒+用户id 一样以时间开头，新旧订单id按字符串排序即按创建时间排序
+# 每个进程有自己的机器号，同一毫秒内用序号区分，生成时不需要访问数据库或redis
+
+# 机器号个数，每个进程启动后第一次生成id时用redis计数器分配，所有服务器共用计数器
+# 同一台服务器的多个进程不会共用机器号
+ORDER_ID_WORKERS = 10000
+ORDER_ID_WORKER_KEY = 'order_id_worker'
+# 每个机器每毫秒最多生成的id数
+ORDER_ID_SEQUENCE = 10000
+
+
+class OrderIdGenerator(object):
+    """雪花算法风格的订单id生成器，线程安全"""
+    def __init__(self):
+        self._worker_id = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._last_ms = 0
+        self._sequence = 0
+
+    def _get_worker_id(self):
+        # fork出的子进程重新分配机器号，避免与父进程重复
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            conn = get_redis_connection('default')
+            self._worker_id = conn.incr(ORDER_ID_WORKER_KEY) % ORDER_ID_WORKERS
+            self._last_ms = 0
+            self._sequence = 0
+        return self._worker_id
+
+    def next_id(self):
+        with self._lock:
+            worker_id = self._get_worker_id()
+            now_ms = int(time.time() * 1000)
+            if now_ms <= self._last_ms:
+                # 同一毫秒内或者系统时间回拨，沿用上次的时间递增序号
+                now_ms = self._last_ms
+                self._sequence += 1
+                if self._sequence >= ORDER_ID_SEQUENCE:
+                    # 本毫秒的序号已用完，使用下一毫秒
+                    now_ms += 1
+                    self._sequence = 0
+            else:
+                self._sequence = 0
+            self._last_ms = now_ms
+            sequence = self._sequence
+
+        return '%s%03d%04d%04d' % (datetime.fromtimestamp(now_ms // 1000).strftime('%Y%m%d%H%M%S'),
+                                   now_ms % 1000, worker_id, sequence)
+
+
+_generator = OrderIdGenerator()
+
+
+def new_order_id():
+    """生成新的订单id，按创建时间有序且不会重复"""
+    return _generator.next_id()
@@ -0,0 +1,239 @@
+import http.client
+import json
+import logging
+import os
+import socket
+import threading
+from base64 import b64decode
+from urllib.parse import urlsplit
+from django.conf import settings
+from django_redis import get_redis_connection
+from alipay import AliPay
+from Cryptodome.Hash import SHA256
+from Cryptodome.Signature import PKCS1_v1_5
+from order.models import OrderInfo
+from order.expiry import cancel_order_expiry
+
+# 订单支付结果，由支付宝异步通知或后台轮询写入，查询支付结果时只读这个key
+PAY_STATUS_KEY = 'pay_status_%s'
+# 订单正在被后台轮询的标记，防止重复调度轮询任务
+PAY_POLLING_KEY = 'pay_polling_%s'
+# 超时取消之后才支付成功、需要退款的订单id集合
+PAY_REFUND_KEY = 'pay_refund'
+
+# 支付结果
+PAY_SUCCESS = 'paid'
+PAY_WAITING = 'waiting'
+PAY_FAILED = 'failed'
+PAY_REFUND = 'refund'
+
+logger = logging.getLogger(__name__)
+
+
+class PaymentGatewayError(Exception):
+    pass
+
+
+class PaymentGateway(object):
+    """支付宝接口客户端
+
+    创建时读取并解析密钥，之后的请求复用同一个AliPay对象，每个线程复用一个到网关的http长连接，查询接口有超时
+    """
+    def __init__(self, gateway_url=None, alipay_public_key_path=None, timeout=None):
+        self.alipay = AliPay(
+            appid=settings.ALIPAY_APPID,  # 应用id
+            app_notify_url=settings.ALIPAY_NOTIFY_URL,  # 默认回调url
+            app_private_key_path=settings.ALIPAY_APP_PRIVATE_KEY_PATH,
+            # 支付宝的公钥，验证支付宝回传消息使用，不是你自己的公钥,
+            alipay_public_key_path=alipay_public_key_path or settings.ALIPAY_PUBLIC_KEY_PATH,
+            sign_type="RSA2",  # RSA 或者 RSA2
+            debug=True  # 默认False
+        )
+        self.gateway_url = gateway_url or settings.ALIPAY_GATEWAY_URL
+        self.timeout = timeout or settings.ALIPAY_TIMEOUT
+        self._local = threading.local()
+
+    def _connection(self):
+        """当前线程到网关的http连接，http.client的连接不能在线程间共用"""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            url = urlsplit(self.gateway_url)
+            if url.scheme == 'https':
+                connection = http.client.HTTPSConnection(url.netloc, timeout=self.timeout)
+            else:
+                connection = http.client.HTTPConnection(url.netloc, timeout=self.timeout)
+            self._local.connection = connection
+        return connection
+
+    def _get(self, query):
+        """向网关发送GET请求，返回响应内容，长连接已被网关关闭时重新连接一次"""
+        path = urlsplit(self.gateway_url).path + '?' + query
+        for retry in (False, True):
+            connection = self._connection()
+            try:
+                connection.request('GET', path)
+                response = connection.getresponse()
+                body = response.read().decode('utf8')
+            except (http.client.HTTPException, OSError) as e:
+                connection.close()
+                self._local.connection = None
+                if retry or isinstance(e, socket.timeout):
+                    raise
+                continue
+            if response.status != 200:
+                raise PaymentGatewayError('支付宝网关返回%d' % response.status)
+            return body
+
+    def _verify_response(self, raw, response_type):
+        """用已解析的支付宝公钥校验同步响应的签名，返回响应内容
+
+        签名的是响应中response_type对应的原始json字符串
+        """
+        start = raw.find('{', raw.find('"%s"' % response_type))
+        result, end = json.JSONDecoder().raw_decode(raw, start)
+        signature = json.loads(raw).get('sign')
+        digest = SHA256.new(raw[start:end].encode('utf8'))  # RSA2
+        if not signature or not PKCS1_v1_5.new(self.alipay.alipay_public_key).verify(digest, b64decode(signature)):
+            raise PaymentGatewayError('支付宝响应验签失败')
+        return result
+
+    def page_pay_url(self, order_id, total_pay, subject):
+        """电脑网站支付的跳转地址"""
+        order_string = self.alipay.api_alipay_trade_page_pay(
+            out_trade_no=order_id,  # 订单id
+            total_amount=str(total_pay),  # 支付总金额
+            subject=subject,
+            return_url=None,
+            notify_url=None  # 可选, 不填则使用默认notify url
+        )
+        return self.gateway_url + '?' + order_string
+
+    def query(self, order_id):
+        """调用交易查询接口，返回验签后的响应内容"""
+        data = self.alipay.build_body('alipay.trade.query', {'out_trade_no': order_id})
+        return self._verify_response(self._get(self.alipay.sign_data(data)), 'alipay_trade_query_response')
+
+    def verify(self, data, signature):
+        """校验支付宝异步通知的签名"""
+        return self.alipay.verify(data, signature)
+
+
+_gateway = None
+_gateway_pid = None
+
+
+def get_payment_gateway():
+    """获取当前进程的支付宝接口客户端，fork出的子进程重新创建，不共用http连接"""
+    global _gateway, _gateway_pid
+    if _gateway is None or _gateway_pid != os.getpid():
+        _gateway = PaymentGateway()
+        _gateway_pid = os.getpid()
+    return _gateway
+
+
+def pay_poll_delay(attempt):
+    """第attempt次轮询前等待的秒数，指数退避"""
+    return min(settings.PAY_POLL_INITIAL_DELAY * 2 ** attempt, settings.PAY_POLL_MAX_DELAY)
+
+
+def _pay_poll_span():
+    return sum(pay_poll_delay(attempt) for attempt in range(settings.PAY_POLL_MAX_ATTEMPTS + 1))
+
+
+def get_pay_status(order_id, conn=None):
+    """获取订单的支付结果，还没有结果时返回PAY_WAITING"""
+    if conn is None:
+        conn = get_redis_connection('default')
+    status = conn.get(PAY_STATUS_KEY % order_id)
+    if status is None:
+        return PAY_WAITING
+    return status.decode()
+
+
+def _set_pay_status(conn, order_id, status):
+    conn.set(PAY_STATUS_KEY % order_id, status, ex=settings.PAY_STATUS_TTL)
+
+
+def confirm_payment(order_id, trade_no, conn=None):
+    """支付成功，更新订单状态和支付宝交易号，返回PAY_SUCCESS或PAY_REFUND
+
+    只更新待支付的订单，异步通知和轮询重复确认时不会覆盖
+    订单已经超时取消时库存已经归还，不恢复订单，记录交易号并登记退款
+    """
+    if conn is None:
+        conn = get_redis_connection('default')
+    if OrderInfo.objects.filter(order_id=order_id, order_status=1).update(trade_no=trade_no, order_status=4):  # 待评价
+        status = PAY_SUCCESS
+    elif OrderInfo.objects.filter(order_id=order_id, order_status=6).update(trade_no=trade_no):
+        # 订单已取消
+        logger.error('订单%s已取消，支付宝交易%s需要退款', order_id, trade_no)
+        conn.sadd(PAY_REFUND_KEY, order_id)
+        status = PAY_REFUND
+    else:
+        # 已经确认过支付
+        status = PAY_SUCCESS
+    _set_pay_status(conn, order_id, status)
+    cancel_order_expiry(order_id, conn)
+    return status
+
+
+def schedule_payment_poll(order_id, conn=None):
+    """开始后台轮询订单的支付结果，已经在轮询时不重复调度，返回是否调度"""
+    from celery_tasks.tasks import poll_payment
+    if conn is None:
+        conn = get_redis_connection('default')
+    if not conn.set(PAY_POLLING_KEY % order_id, 1, ex=_pay_poll_span(), nx=True):
+        return False
+    poll_payment.apply_async((order_id,), countdown=pay_poll_delay(0))
+    return True
+
+
+def start_payment_poll(order_id, conn=None):
+    """用户发起支付时清除上次失败的结果并开始轮询"""
+    if conn is None:
+        conn = get_redis_connection('default')
+    if get_pay_status(order_id, conn) == PAY_FAILED:
+        conn.delete(PAY_STATUS_KEY % order_id)
+    return schedule_payment_poll(order_id, conn)
+
+
+def check_payment(order_id):
+    """调用支付宝的交易查询接口，更新订单的支付结果
+
+    返回PAY_SUCCESS、PAY_WAITING、PAY_FAILED或PAY_REFUND
+    """
+    conn = get_redis_connection('default')
+    order = OrderInfo.objects.filter(order_id=order_id).only('order_status', 'trade_no').first()
+    if order is None:
+        # 订单不存在
+        _set_pay_status(conn, order_id, PAY_FAILED)
+        return PAY_FAILED
+    if order.order_status == 6 and order.trade_no:
+        # 订单已取消，已经登记退款
+        return PAY_REFUND
+    if order.order_status not in (1, 6):
+        # 订单已经确认支付
+        _set_pay_status(conn, order_id, PAY_SUCCESS)
+        return PAY_SUCCESS
+
+    # 已取消的订单仍然查询，买家在取消之后付款时登记退款
+    response = get_payment_gateway().query(order_id)
+    code = response.get('code')
+    if code == '10000' and response.get('trade_status') in ('TRADE_SUCCESS', 'TRADE_FINISHED'):
+        # 支付成功
+        return confirm_payment(order_id, response.get('trade_no'), conn)
+    if code == '40004' or (code == '10000' and response.get('trade_status') == 'WAIT_BUYER_PAY'):
+        if order.order_status == 6:
+            # 订单已取消，不再等待付款
+            _set_pay_status(conn, order_id, PAY_FAILED)
+            return PAY_FAILED
+        # 等待买家付款
+        return PAY_WAITING
+    # 支付出错
+    _set_pay_status(conn, order_id, PAY_FAILED)
+    return PAY_FAILED
+
+
+def finish_payment_poll(order_id):
+    """轮询结束，清除轮询标记，之后查询支付结果时可以重新开始轮询"""
+    get_redis_connection('default').delete(PAY_POLLING_KEY % order_id)
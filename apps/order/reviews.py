@@ -0,0 +1,105 @@
+import json
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django_redis import get_redis_connection
+from order.models import OrderGoods
+
+# 商品最新的若干条评论和评论总数在redis中的有效期，过期后从数据库重建
+REVIEW_CACHE_TIMEOUT = 24 * 3600
+
+# 只有评论缓存已存在时才追加，缓存不存在时下次读取会从数据库重建
+PUBLISH_REVIEW_SCRIPT = """
+if redis.call('exists', KEYS[1]) == 1 then
+    redis.call('incr', KEYS[1])
+    redis.call('lpush', KEYS[2], ARGV[1])
+    redis.call('ltrim', KEYS[2], 0, tonumber(ARGV[2]) - 1)
+    return 1
+end
+return 0
+"""
+
+
+def review_count_key(sku_id):
+    return 'sku_review_count_%d' % int(sku_id)
+
+
+def review_list_key(sku_id):
+    return 'sku_reviews_%d' % int(sku_id)
+
+
+def _serialize(order_goods, username):
+    """把一条订单商品评论转换成可以保存到redis的字典"""
+    return {'id': order_goods.id,
+            'username': username,
+            'comment': order_goods.comment,
+            'time': order_goods.update_time.isoformat()}
+
+
+def _deserialize(data):
+    review = json.loads(data.decode() if isinstance(data, bytes) else data)
+    review['time'] = parse_datetime(review['time'])
+    return review
+
+
+def commented_goods(sku_id):
+    """商品有评论的订单商品，按评论时间倒序"""
+    return OrderGoods.objects.filter(sku_id=sku_id).exclude(comment='').order_by('-update_time', '-id')
+
+
+def publish_reviews(order_goods_list, username):
+    """评论保存之后，更新对应商品的评论总数和最新评论
+
+    每条评论只能发布一次，调用者只传入之前没有评论、这次新增评论的订单商品
+    """
+    conn = get_redis_connection('default')
+    pipe = conn.pipeline(transaction=False)
+    for order_goods in order_goods_list:
+        if not order_goods.comment:
+            continue
+        pipe.eval(PUBLISH_REVIEW_SCRIPT, 2,
+                  review_count_key(order_goods.sku_id), review_list_key(order_goods.sku_id),
+                  json.dumps(_serialize(order_goods, username)), settings.REVIEW_LATEST_COUNT)
+    pipe.execute()
+
+
+def get_latest_reviews(sku_id):
+    """获取商品的评论总数和最新的若干条评论"""
+    conn = get_redis_connection('default')
+    pipe = conn.pipeline(transaction=False)
+    pipe.get(review_count_key(sku_id))
+    pipe.lrange(review_list_key(sku_id), 0, -1)
+    count, reviews = pipe.execute()
+    if count is not None:
+        return int(count), [_deserialize(review) for review in reviews]
+
+    # 缓存不存在，从数据库重建
+    count = commented_goods(sku_id).count()
+    order_goods_list = commented_goods(sku_id).select_related('order__user')[:settings.REVIEW_LATEST_COUNT]
+    reviews = [_serialize(order_goods, order_goods.order.user.username) for order_goods in order_goods_list]
+
+    pipe = conn.pipeline()
+    pipe.delete(review_list_key(sku_id))
+    if reviews:
+        pipe.rpush(review_list_key(sku_id), *[json.dumps(review) for review in reviews])
+        pipe.expire(review_list_key(sku_id), REVIEW_CACHE_TIMEOUT)
+    pipe.set(review_count_key(sku_id), count, ex=REVIEW_CACHE_TIMEOUT)
+    pipe.execute()
+
+    for review in reviews:
+        review['time'] = parse_datetime(review['time'])
+    return count, reviews
+
+
+def get_older_reviews(sku_id, before_time, before_id, limit):
+    """按(评论时间, id)游标获取更早的评论，不使用offset，翻到哪一页代价都一样"""
+    order_goods_list = commented_goods(sku_id).filter(
+        Q(update_time__lt=before_time) | Q(update_time=before_time, id__lt=before_id)
+    ).select_related('order__user')[:limit]
+    return [_serialize(order_goods, order_goods.order.user.username) for order_goods in order_goods_list]
+
+
+def format_review_time(time):
+    """评论时间转换成本地时间字符串"""
+    return timezone.localtime(time).strftime('%Y-%m-%d %H:%M:%S')
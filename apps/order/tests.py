@@ -1,3 +1,171 @@
+import os
+import tempfile
+import threading
+from unittest import mock
+from Cryptodome.PublicKey import RSA
 from django.test import TestCase
+from django_redis import get_redis_connection
+from user.models import User, Address
+from order.models import OrderInfo
+from order.order_id import OrderIdGenerator, new_order_id, ORDER_ID_SEQUENCE
+from order.fake_gateway import FakeAlipayGateway
+from order.payment import PaymentGateway, PaymentGatewayError, check_payment, get_pay_status, \
+    PAY_STATUS_KEY, PAY_REFUND_KEY, PAY_SUCCESS, PAY_WAITING, PAY_REFUND
 
 # Create your tests here.
+
+
+class PaymentTest(TestCase):
+    """使用本地模拟网关测试支付宝接口客户端和支付结果查询"""
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.gateway = FakeAlipayGateway().start()
+        fd, cls.public_key_path = tempfile.mkstemp(suffix='.pem')
+        os.close(fd)
+        cls.gateway.write_public_key(cls.public_key_path)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.gateway.stop()
+        os.remove(cls.public_key_path)
+        super().tearDownClass()
+
+    def setUp(self):
+        self.alipay = PaymentGateway(gateway_url=self.gateway.url, alipay_public_key_path=self.public_key_path)
+        patcher = mock.patch('order.payment.get_payment_gateway', return_value=self.alipay)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        user = User.objects.create_user('paytest', 'paytest@example.com', 'paytest')
+        addr = Address.objects.create(user=user, receiver='paytest', addr='paytest', phone='13800000000')
+        self.order_id = new_order_id()
+        OrderInfo.objects.create(order_id=self.order_id, user=user, addr=addr, pay_method=3,
+                                 total_price=10, transit_price=10)
+
+        conn = get_redis_connection('default')
+        self.addCleanup(conn.delete, PAY_STATUS_KEY % self.order_id)
+        self.addCleanup(conn.srem, PAY_REFUND_KEY, self.order_id)
+
+    def order(self):
+        return OrderInfo.objects.get(order_id=self.order_id)
+
+    def test_query_waiting(self):
+        self.gateway.pay_after = 3600
+        response = self.alipay.query(self.order_id)
+        self.assertEqual(response['code'], '10000')
+        self.assertEqual(response['trade_status'], 'WAIT_BUYER_PAY')
+
+    def test_query_paid(self):
+        self.gateway.pay_after = 0
+        response = self.alipay.query(self.order_id)
+        self.assertEqual(response['trade_status'], 'TRADE_SUCCESS')
+        self.assertEqual(response['trade_no'], 'FAKE%s' % self.order_id)
+
+    def test_query_reuses_connection(self):
+        self.alipay.query(self.order_id)
+        connection = self.alipay._connection()
+        self.alipay.query(self.order_id)
+        self.assertIs(self.alipay._connection(), connection)
+
+    def test_query_rejects_bad_signature(self):
+        fd, path = tempfile.mkstemp(suffix='.pem')
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+        with open(path, 'wb') as f:
+            f.write(RSA.generate(2048).publickey().exportKey())
+        alipay = PaymentGateway(gateway_url=self.gateway.url, alipay_public_key_path=path)
+        with self.assertRaises(PaymentGatewayError):
+            alipay.query(self.order_id)
+
+    def test_check_payment_paid(self):
+        self.gateway.pay_after = 0
+        self.assertEqual(check_payment(self.order_id), PAY_SUCCESS)
+        order = self.order()
+        self.assertEqual(order.order_status, 4)
+        self.assertEqual(order.trade_no, 'FAKE%s' % self.order_id)
+        self.assertEqual(get_pay_status(self.order_id), PAY_SUCCESS)
+
+    def test_check_payment_waiting(self):
+        self.gateway.pay_after = 3600
+        self.assertEqual(check_payment(self.order_id), PAY_WAITING)
+        self.assertEqual(self.order().order_status, 1)
+        self.assertEqual(get_pay_status(self.order_id), PAY_WAITING)
+
+    def test_check_payment_cancelled_then_paid(self):
+        # 订单超时取消之后买家才付款，不恢复订单，登记退款
+        OrderInfo.objects.filter(order_id=self.order_id).update(order_status=6)
+        self.gateway.pay_after = 0
+        self.assertEqual(check_payment(self.order_id), PAY_REFUND)
+        order = self.order()
+        self.assertEqual(order.order_status, 6)
+        self.assertEqual(order.trade_no, 'FAKE%s' % self.order_id)
+        self.assertEqual(get_pay_status(self.order_id), PAY_REFUND)
+        self.assertTrue(get_redis_connection('default').sismember(PAY_REFUND_KEY, self.order_id))
+
+
+def split_order_id(order_id):
+    """拆分订单id，返回(时间, 毫秒, 机器号, 序号)"""
+    return order_id[:14], int(order_id[14:17]), int(order_id[17:21]), int(order_id[21:])
+
+
+class OrderIdTest(TestCase):
+    """订单id生成器"""
+    def fake_time(self, *values):
+        """让生成器依次读到values中的时间"""
+        patcher = mock.patch('order.order_id.time')
+        fake = patcher.start()
+        self.addCleanup(patcher.stop)
+        fake.time.side_effect = list(values)
+
+    def test_unique_and_ordered(self):
+        generator = OrderIdGenerator()
+        ids = [generator.next_id() for i in range(20000)]
+        self.assertEqual(len(set(ids)), len(ids))
+        self.assertEqual(ids, sorted(ids))
+        self.assertTrue(all(len(order_id) == 25 for order_id in ids))
+
+    def test_unique_across_threads(self):
+        generator = OrderIdGenerator()
+        ids = []
+
+        def generate():
+            ids.extend(generator.next_id() for i in range(2000))
+
+        threads = [threading.Thread(target=generate) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(set(ids)), 8000)
+
+    def test_sequence_rollover(self):
+        # 同一毫秒内序号用完后使用下一毫秒
+        generator = OrderIdGenerator()
+        self.fake_time(*[1500000000.5] * (ORDER_ID_SEQUENCE + 1))
+        ids = [generator.next_id() for i in range(ORDER_ID_SEQUENCE + 1)]
+        self.assertEqual(len(set(ids)), len(ids))
+        self.assertEqual(ids, sorted(ids))
+        _, first_ms, _, first_sequence = split_order_id(ids[0])
+        _, last_ms, _, last_sequence = split_order_id(ids[-1])
+        self.assertEqual(first_sequence, 0)
+        self.assertEqual(split_order_id(ids[-2])[3], ORDER_ID_SEQUENCE - 1)
+        self.assertEqual((last_ms, last_sequence), (first_ms + 1, 0))
+
+    def test_clock_rollback(self):
+        # 系统时间回拨时沿用上次的时间递增序号，id仍然递增
+        generator = OrderIdGenerator()
+        self.fake_time(1500000000.5, 1500000000.1)
+        first = generator.next_id()
+        second = generator.next_id()
+        self.assertGreater(second, first)
+        self.assertEqual(split_order_id(second)[:3], split_order_id(first)[:3])
+        self.assertEqual(split_order_id(second)[3], split_order_id(first)[3] + 1)
+
+    def test_worker_per_process(self):
+        # fork出的子进程重新分配机器号
+        generator = OrderIdGenerator()
+        first = generator.next_id()
+        with mock.patch('order.order_id.os.getpid', return_value=-1):
+            second = generator.next_id()
+        self.assertNotEqual(split_order_id(second)[2], split_order_id(first)[2])
@@ -1,10 +1,13 @@
 from django.conf.urls import url
-from order.views import OrderPlaceView, OrderCommitView, OrderPayView, CheckPayView, CommentView
+from order.views import OrderPlaceView, OrderCommitView, OrderPayView, CheckPayView, CommentView, \
+    OrderStatusView, AlipayNotifyView
 
 urlpatterns = [
     url(r'^place$', OrderPlaceView.as_view(), name='place'),  # 提交订单页面显示
     url(r'^commit$', OrderCommitView.as_view(), name='commit'),   # 创建订单页面显示
+    url(r'^status$', OrderStatusView.as_view(), name='status'),  # 秒杀订单创建状态
     url(r'^pay$', OrderPayView.as_view(), name='pay'),  # 订单支付
+    url(r'^notify$', AlipayNotifyView.as_view(), name='notify'),  # 支付宝异步通知
     url(r'^check$', CheckPayView.as_view(), name='check'),  # 查询支付结果
     url(r'^comment/(?P<order_id>.+)$', CommentView.as_view(), name='comment'),  # 订单评论
 ]
@@ -3,15 +3,29 @@ from django.core.urlresolvers import reverse
 from django.views.generic import View
 from goods.models import GoodsSKU
 from user.models import Address
+from user.addresses import get_user_addresses
 from django_redis import get_redis_connection
 from utils.mixin import LoginRequiredMixin
 from django.http import JsonResponse
 from order.models import OrderInfo, OrderGoods
-from datetime import datetime
+from order.order_id import new_order_id
+from order.expiry import schedule_order_expiry
+from goods.rankings import incr_sales_rankings
+from cart.storage import clear_cart_count, delete_from_cart
+from goods.sku_snapshot import get_sku_snapshots, invalidate_sku_snapshots
+from goods.stock import get_stocks, decr_stocks, sell_stocks
+from order.flash_sale import get_flash_sale_skus, reserve_flash_sale, release_flash_sale, get_flash_order_status, \
+    FLASH_RESERVE_OK, FLASH_RESERVE_NO_STOCK, FLASH_RESERVE_NO_CART, FLASH_ORDER_CREATED, FLASH_ORDER_FAILED
+from celery_tasks.tasks import create_flash_sale_order, publish_order_reviews
+from django.db.models import Case, When, Value, CharField
+from django.utils import timezone
 from django.db import transaction
-from alipay import AliPay
-from django.conf import settings
-import os
+from order.payment import get_payment_gateway, get_pay_status, confirm_payment, start_payment_poll, schedule_payment_poll, \
+    PAY_SUCCESS, PAY_FAILED, PAY_REFUND
+from django.http import HttpResponse
+from django.utils.decorators import method_decorator
+from django.views.decorators.csrf import csrf_exempt
+from decimal import Decimal
 
 # Create your views here.
 
@@ -24,7 +38,7 @@ class OrderPlaceView(LoginRequiredMixin, View):
         sku_ids = request.POST.getlist('sku_ids')
 
         # 校验数据
-        if not sku_ids:
+        if not sku_ids or not all(sku_id.isdigit() for sku_id in sku_ids):
             # 跳转到购物车界面
             return redirect(reverse('cart:show'))
 
@@ -35,19 +49,24 @@ class OrderPlaceView(LoginRequiredMixin, View):
         # 分别保存商品的总价格和总件数
         total_price = 0
         total_count = 0
-        for sku_id in sku_ids:
+        # 一次hmget获取用户所要购买的所有商品的数量，一次批量获取所有商品的快照信息
+        counts = conn.hmget(cart_key, sku_ids)
+        snapshots = get_sku_snapshots(sku_ids, conn)
+        for sku_id, count in zip(sku_ids, counts):
             # 根据商品的id获取商品的信息
-            sku = GoodsSKU.objects.get(id=sku_id)
-            # 获取用户所要购买的商品的数量
-            count = conn.hget(cart_key, sku_id)
+            sku = snapshots.get(int(sku_id))
+            if sku is None or count is None:
+                # 商品不存在或者已不在购物车中，回到购物车
+                return redirect(reverse('cart:show'))
+            count = int(count)
             # 计算商品的小计
-            amount = sku.price*int(count)
+            amount = sku.price*count
             # 动态给sku增加属性
             sku.count = count
             sku.amount = amount
             skus.append(sku)
             total_price += amount
-            total_count += int(count)
+            total_count += count
 
         # 运费：实际开发的时候，属于一个子系统
         transit_price = 10
@@ -55,8 +74,8 @@ class OrderPlaceView(LoginRequiredMixin, View):
         # 实付款
         total_pay = total_price + transit_price
 
-        # 获取用户的收件地址
-        addrs = Address.objects.filter(user=user)
+        # 获取用户的收件地址，使用缓存
+        addrs = get_user_addresses(user.id)
 
         # 组织上下文
         sku_ids = ','.join(sku_ids)  # [1, 25] -> 1,25
@@ -104,8 +123,8 @@ class OrderCommitView(View):
 
 
         # 组织参数
-        # 订单编号 id: 20190927163230+用户id
-        order_id = datetime.now().strftime('%Y%m%d%H%M%S')+str(user.id)
+        # 订单编号 id: 20190927163230+毫秒+机器号+序号，按创建时间有序
+        order_id = new_order_id()
 
         # 运费
         transit_price = 10
@@ -114,82 +133,70 @@ class OrderCommitView(View):
         total_count = 0
         total_price = 0
 
+        # 用户的订单有几个商品，需要向df_order_goods表中加几条记录
+        conn = get_redis_connection('default')
+        cart_key = 'cart_%d' % user.id
+        sku_ids = sku_ids.split(',')
+
+        # 秒杀商品在redis中原子地预留库存，订单由celery异步写入数据库，前端轮询订单状态
+        flash_skus = get_flash_sale_skus(sku_ids, conn)
+        if flash_skus:
+            return self.commit_flash_sale(request, conn, cart_key, flash_skus, sku_ids,
+                                          order_id, addr, pay_method, transit_price)
+
+        # 先使用redis中的库存缓存校验，商品不存在或库存不足时不访问数据库
+        # 一次hmget获取所有商品的购买数量
+        try:
+            cached_stocks = get_stocks(sku_ids, conn)
+        except ValueError:
+            return JsonResponse({'res': 4, 'errmsg': '商品不存在'})
+        counts = {}
+        for sku_id, count in zip(sku_ids, conn.hmget(cart_key, sku_ids)):
+            if count is None or int(sku_id) not in cached_stocks:
+                return JsonResponse({'res': 4, 'errmsg': '商品不存在'})
+            if int(count) > cached_stocks[int(sku_id)]:
+                return JsonResponse({'res': 6, 'errmsg': '商品库存不足'})
+            counts[int(sku_id)] = int(count)
+
         # 设置事务保存点
         save_id = transaction.savepoint()
         try:
+            # 一次查询获取所有商品，按id排序
+            skus = list(GoodsSKU.objects.filter(id__in=list(counts)).order_by('id'))
+            if len(skus) != len(counts):
+                # 商品不存在
+                transaction.savepoint_rollback(save_id)
+                return JsonResponse({'res': 4, 'errmsg': '商品不存在'})
+
+            # 判断商品的库存，同时累加计算订单商品的总数目和总价格
+            for sku in skus:
+                if counts[sku.id] > sku.stock:
+                    transaction.savepoint_rollback(save_id)
+                    return JsonResponse({'res': 6, 'errmsg': '商品库存不足'})
+                total_price += sku.price * counts[sku.id]
+                total_count += counts[sku.id]
+
             # 向df_order_info表中添加一条记录
             order = OrderInfo.objects.create(order_id=order_id, user=user,
                                      addr=addr, pay_method=pay_method,
                                      total_count=total_count, total_price=total_price,
                                      transit_price=transit_price)
 
-            # 用户的订单有几个商品，需要向df_order_goods表中加几条记录
-            conn = get_redis_connection('default')
-            cart_key = 'cart_%d' % user.id
-            sku_ids = sku_ids.split(',')
-
-            for sku_id in sku_ids:
-
-                for i in range(3):
-                    # 获取商品的信息
-                    try:
-                        sku = GoodsSKU.objects.get(id=sku_id)
-
-                    except:
-                        # 商品不存在
-                        transaction.savepoint_rollback(save_id)
-                        return JsonResponse({'res': 4, 'errmsg': '商品不存在'})
-
-                    # 从redis中获取用户所要购买的商品数
-                    count = conn.hget(cart_key, sku_id)
-
-
-                    # 判断商品的库存
-                    if int(count) > sku.stock:
-                        transaction.savepoint_rollback(save_id)
-                        return JsonResponse({'res': 6, 'errmsg': '商品库存不足'})
-
+            # 一条update语句更新所有商品的库存和销量
+            res = sell_stocks(counts)
+            # res是受影响的行数，小于商品数说明有商品在此期间被其他订单买走
+            if res != len(skus):
+                transaction.savepoint_rollback(save_id)
+                return JsonResponse({'res': 6, 'errmsg': '商品库存不足'})
 
-                    # 乐观锁
-                    # 更新商品的库存和销量
-                    origin_stock = sku.stock
-                    new_stock = origin_stock - int(count)
-                    new_sales = sku.sales + int(count)
-
-                    # update df_goods_sku set stock=new_stock, sales=new_sales where id=sku_id and stock=orgin_stock
-                    res = GoodsSKU.objects.filter(id=sku_id, stock=origin_stock).update(stock=new_stock, sales=new_sales)
-                    print(res)
-                    # res是一个数字，是受影响的行数，根据filter只能查到一句，所以结果要么是0，要么是1
-                    if res == 0:
-                        if i == 2:
-                            # 尝试第三次
-                            transaction.savepoint_rollback(save_id)
-                            return JsonResponse({'res': 7, 'errmsg': '下单失败'})
-                        continue
-
-
-                    # 向df_order_goods表中添加一条记录
-                    OrderGoods.objects.create(order=order, sku=sku,
-                                              count=count, price=sku.price)
-
-                    # 更新商品的库存和销量
-                    # sku.stock -= int(count)
-                    # sku.sales += int(count)
-                    # sku.save()
-
-                    # 累加计算订单商品的总数目和总价格
-                    amount = sku.price * int(count)
-                    total_price += amount
-                    total_count += int(count)
-
-                    # 跳出循环
-                    break
-
-            # 更新订单信息的商品总数目和总价格
-            order.total_count = total_count
-            order.total_price = total_price
-            order.save()
+            # 一次向df_order_goods表中添加所有记录
+            OrderGoods.objects.bulk_create([OrderGoods(order=order, sku=sku, count=counts[sku.id], price=sku.price)
+                                            for sku in skus])
 
+            # 保存每个商品增加的销量，用于更新人气排序
+            sales = [(sku.type_id, sku.id, counts[sku.id]) for sku in skus]
+            # 保存每个商品购买的数量，用于更新库存缓存
+            sold = counts
 
         except Exception as e:
             transaction.savepoint_rollback(save_id)
@@ -198,11 +205,78 @@ class OrderCommitView(View):
 
         # 提交事务
         transaction.savepoint_commit(save_id)
+        # 商品库存发生变化，更新库存缓存并删除商品快照
+        decr_stocks(sold, conn)
+        invalidate_sku_snapshots(list(sold), conn)
+        # 更新商品种类的人气排序
+        incr_sales_rankings(sales)
         # 清除用户购物车中对应的记录
-        conn.hdel(cart_key, *sku_ids)
+        delete_from_cart(conn, user.id, *sku_ids)
+        clear_cart_count(request)
+        # 登记支付截止时间，超时未支付的订单自动取消
+        schedule_order_expiry(order_id, pay_method, conn)
         # 返回应答
         return JsonResponse({'res': 5, 'message': '创建成功'})
 
+    def commit_flash_sale(self, request, conn, cart_key, flash_skus, sku_ids, order_id, addr, pay_method, transit_price):
+        """秒杀商品下单：预留库存后放入队列"""
+        if len(flash_skus) != len(set(int(sku_id) for sku_id in sku_ids)):
+            return JsonResponse({'res': 8, 'errmsg': '秒杀商品需要单独下单'})
+
+        # 一次hmget获取所有商品的购买数量
+        counts = {}
+        for sku_id, count in zip(sku_ids, conn.hmget(cart_key, sku_ids)):
+            if count is None:
+                return JsonResponse({'res': 4, 'errmsg': '商品不存在'})
+            counts[int(sku_id)] = int(count)
+
+        # 原子地预留所有商品的库存并从购物车中删除，重复提交时不会再次预留
+        result = reserve_flash_sale(conn, order_id, request.user.id, counts)
+        if result == FLASH_RESERVE_NO_CART:
+            return JsonResponse({'res': 4, 'errmsg': '商品不存在'})
+        if result == FLASH_RESERVE_NO_STOCK:
+            return JsonResponse({'res': 6, 'errmsg': '商品库存不足'})
+        if result != FLASH_RESERVE_OK:
+            return JsonResponse({'res': 8, 'errmsg': '秒杀已结束'})
+
+        # 由celery把订单写入数据库
+        try:
+            create_flash_sale_order.delay(order_id, request.user.id, addr.id, int(pay_method), transit_price, counts)
+        except Exception as e:
+            release_flash_sale(conn, counts, request.user.id)
+            return JsonResponse({'res': 7, 'errmsg': '下单失败'})
+        clear_cart_count(request)
+
+        # 返回应答，前端根据订单id查询订单状态
+        return JsonResponse({'res': 9, 'order_id': order_id, 'message': '排队中'})
+
+
+# ajax get
+# 前端传递的参数：订单id(order_id)
+# /order/status
+class OrderStatusView(View):
+    """秒杀订单的创建状态"""
+    def get(self, request):
+        user = request.user
+        if not user.is_authenticated():
+            return JsonResponse({'res': 0, 'errmsg': '用户未登录'})
+
+        order_id = request.GET.get('order_id')
+        if not order_id:
+            return JsonResponse({'res': 1, 'errmsg': '无效订单编号'})
+
+        # 只读取redis中的订单状态，不访问数据库
+        conn = get_redis_connection('default')
+        status = get_flash_order_status(conn, order_id, user.id)
+        if status is None:
+            return JsonResponse({'res': 1, 'errmsg': '无效订单编号'})
+        status, errmsg = status
+        if status == FLASH_ORDER_CREATED:
+            return JsonResponse({'res': 5, 'message': '创建成功'})
+        if status == FLASH_ORDER_FAILED:
+            return JsonResponse({'res': 7, 'errmsg': errmsg or '下单失败'})
+        return JsonResponse({'res': 9, 'message': '排队中'})
+
 
 # ajax post
 # 前端传递的参数：订单id(order_id)
@@ -231,33 +305,50 @@ class OrderPayView(View):
             return JsonResponse({'res': 2, 'errmsg': '订单错误'})
 
         # 业务处理：使用python sdk调用支付宝的支付接口
-        # 初始化
-        alipay = AliPay(
-            appid="2016101300678643",  # 应用id
-            app_notify_url=None,  # 默认回调url
-            app_private_key_path=os.path.join(settings.BASE_DIR, 'apps/order/app_private_key.pem'),
-            alipay_public_key_path=os.path.join(settings.BASE_DIR, 'apps/order/alipay_public_key.pem'),
-            # 支付宝的公钥，验证支付宝回传消息使用，不是你自己的公钥,
-            sign_type="RSA2",  # RSA 或者 RSA2
-            debug=True  # 默认False
-        )
-
         # 调用支付接口
         # 电脑网站支付，需要跳转到https://openapi.alipaydev.com/gateway.do? + order_string
         total_pay = order.total_price + order.transit_price  # Decimal
-        order_string = alipay.api_alipay_trade_page_pay(
-            out_trade_no=order_id,  # 订单id
-            total_amount=str(total_pay),  # 支付总金额
-            subject='天天生鲜%s' % order_id,
-            return_url=None,
-            notify_url=None  # 可选, 不填则使用默认notify url
-        )
+        pay_url = get_payment_gateway().page_pay_url(order_id, total_pay, '天天生鲜%s' % order_id)
+
+        # 后台轮询支付结果，支付宝异步通知先到达时轮询会提前结束
+        start_payment_poll(order_id)
 
         # 返回应答
-        pay_url = 'https://openapi.alipaydev.com/gateway.do?' + order_string
         return JsonResponse({'res': 3, 'pay_url': pay_url})
 
 
+# 支付宝服务器发起的post请求，参数为交易信息和签名
+# /order/notify
+class AlipayNotifyView(View):
+    """支付宝异步通知"""
+    @method_decorator(csrf_exempt)
+    def dispatch(self, request, *args, **kwargs):
+        # 支付宝的请求没有csrf token
+        return super().dispatch(request, *args, **kwargs)
+
+    def post(self, request):
+        data = request.POST.dict()
+        signature = data.pop('sign', None)
+        # 校验签名，防止伪造的通知
+        if not signature or not get_payment_gateway().verify(data, signature):
+            return HttpResponse('failure')
+
+        if data.get('trade_status') in ('TRADE_SUCCESS', 'TRADE_FINISHED'):
+            order_id = data.get('out_trade_no')
+            try:
+                order = OrderInfo.objects.get(order_id=order_id)
+            except OrderInfo.DoesNotExist:
+                return HttpResponse('failure')
+            # 校验支付金额
+            if Decimal(data.get('total_amount', '0')) != order.total_price + order.transit_price:
+                return HttpResponse('failure')
+            # 订单已超时取消时confirm_payment记录日志并登记退款，不会当作支付成功
+            confirm_payment(order_id, data.get('trade_no'))
+
+        # 返回success后支付宝不再重复通知
+        return HttpResponse('success')
+
+
 # ajax post
 # 前端传递的参数：订单id（order_id)
 # /order/check
@@ -280,71 +371,33 @@ class CheckPayView(View):
         try:
             order = OrderInfo.objects.get(order_id=order_id,
                                           user=user,
-                                          pay_method=3,
-                                          order_status=1)
+                                          pay_method=3)
         except OrderInfo.DoesNotExist:
             return JsonResponse({'res': 2, 'errmsg': '订单错误'})
 
-        # 业务处理：使用python sdk调用支付宝的支付接口
-        # 初始化
-        alipay = AliPay(
-            appid="2016101300678643",  # 应用id
-            app_notify_url=None,  # 默认回调url
-            app_private_key_path=os.path.join(settings.BASE_DIR, 'apps/order/app_private_key.pem'),
-            alipay_public_key_path=os.path.join(settings.BASE_DIR, 'apps/order/alipay_public_key.pem'),
-            # 支付宝的公钥，验证支付宝回传消息使用，不是你自己的公钥,
-            sign_type="RSA2",  # RSA 或者 RSA2
-            debug=True  # 默认False
-        )
-
-        # 调用支付宝的交易查询接口
-        response = alipay.api_alipay_trade_query(order_id)
-
-        # response = {
-        #         "trade_no": "2017032121001004070200176844",  支付宝交易号
-        #         "code": "10000",   接口调用是否成功
-        #         "invoice_amount": "20.00",
-        #         "open_id": "20880072506750308812798160715407",
-        #         "fund_bill_list": [
-        #             {
-        #                 "amount": "20.00",
-        #                 "fund_channel": "ALIPAYACCOUNT"
-        #             }
-        #         ],
-        #         "buyer_logon_id": "csq***@sandbox.com",
-        #         "send_pay_date": "2017-03-21 13:29:17",
-        #         "receipt_amount": "20.00",
-        #         "out_trade_no": "out_trade_no15",
-        #         "buyer_pay_amount": "20.00",
-        #         "buyer_user_id": "2088102169481075",
-        #         "msg": "Success",
-        #         "point_amount": "0.00",
-        #         "trade_status": "TRADE_SUCCESS",   支付结果
-        #         "total_amount": "20.00"
-        # }
-
-        code = response.get('code')
-
-        while True:
-            if code == '10000' and response.get('trade_status') == 'TRADE_SUCCESS':
-                # 支付成功
-                # 获取支付宝交易号
-                trade_no = response.get('trade_no')
-                # 更新订单的状态
-                order.trade_no = trade_no
-                order.order_status = 4  # 待评价
-                order.save()
-                # 返回结果
-                return JsonResponse({'res': 3, 'message': '支付成功'})
-            elif code == '40004' or (code == '10000' and response.get('trade_status') == 'WAIT_BUYER_PAY'):
-                # 等待买家付款
-                # 业务处理失败，可能一会就会成功
-                import time
-                time.sleep(5)
-                continue
-            else:
-                # 支付出错
-                return JsonResponse({'res': 4, 'errmsg': '支付失败'})
+        # 支付结果由支付宝异步通知或后台轮询写入redis，这里只读取结果，不等待
+        # 前端在返回等待付款时隔几秒再次查询
+        conn = get_redis_connection('default')
+        status = get_pay_status(order_id, conn)
+        if status == PAY_SUCCESS:
+            # 支付成功
+            return JsonResponse({'res': 3, 'message': '支付成功'})
+        if status == PAY_REFUND:
+            # 订单取消之后才付款
+            return JsonResponse({'res': 4, 'errmsg': '订单已取消，支付的款项将退回'})
+        if status == PAY_FAILED:
+            # 支付出错
+            return JsonResponse({'res': 4, 'errmsg': '支付失败'})
+        if order.order_status == 6:
+            # 订单已超时取消
+            return JsonResponse({'res': 4, 'errmsg': '订单已取消'})
+        if order.order_status != 1:
+            # 订单已经确认支付，结果已过期
+            return JsonResponse({'res': 3, 'message': '支付成功'})
+
+        # 等待买家付款，后台轮询已结束时重新开始
+        schedule_payment_poll(order_id, conn)
+        return JsonResponse({'res': 5, 'message': '等待付款'})
 
 
 class CommentView(LoginRequiredMixin, View):
@@ -385,8 +438,9 @@ class CommentView(LoginRequiredMixin, View):
         if not order_id:
             return redirect(reverse('user:order'))
 
+        # 只有待评价的订单可以评论
         try:
-            order = OrderInfo.objects.get(order_id=order_id, user=user)
+            order = OrderInfo.objects.get(order_id=order_id, user=user, order_status=4)
         except OrderInfo.DoesNotExist:
             return redirect(reverse("user:order"))
 
@@ -394,21 +448,38 @@ class CommentView(LoginRequiredMixin, View):
         total_count = request.POST.get("total_count")
         total_count = int(total_count)
 
-        # 循环获取订单中商品的评论内容
+        # 循环获取订单中商品的评论内容 {商品id: 评论内容}
+        contents = {}
         for i in range(1, total_count + 1):
             # 获取评论的商品的id
             sku_id = request.POST.get("sku_%d" % i) # sku_1 sku_2
             # 获取评论的商品的内容
             content = request.POST.get('content_%d' % i, '') # cotent_1 content_2 content_3
             try:
-                order_goods = OrderGoods.objects.get(order=order, sku_id=sku_id)
-            except OrderGoods.DoesNotExist:
+                contents[int(sku_id)] = content
+            except (TypeError, ValueError):
                 continue
 
-            order_goods.comment = content
-            order_goods.save()
-
-        order.order_status = 5 # 已完成
-        order.save()
+        commented = []
+        with transaction.atomic():
+            # 先把待评价的订单改为已完成，同时锁住订单，重复提交或订单状态已变化时不保存评论
+            if OrderInfo.objects.filter(order_id=order.order_id, order_status=4).update(order_status=5):  # 已完成
+                # 一次查询订单中还没有评论的商品，已经评论过的商品不再修改
+                # 评论总数和最新评论中不会出现重复
+                commented = [order_goods for order_goods in OrderGoods.objects
+                             .filter(order=order, sku_id__in=list(contents), comment='').only('id', 'sku_id')
+                             if contents[order_goods.sku_id]]
+            if commented:
+                # 一条update语句保存所有评论，只更新评论和评论时间
+                # update df_order_goods set comment=case id when ... end, update_time=now where id in (...)
+                # update不会自动更新auto_now字段，评论按update_time排序，所以需要显式设置
+                comment_case = Case(*[When(id=order_goods.id, then=Value(contents[order_goods.sku_id]))
+                                      for order_goods in commented], output_field=CharField())
+                OrderGoods.objects.filter(id__in=[order_goods.id for order_goods in commented], comment='') \
+                    .update(comment=comment_case, update_time=timezone.now())
+
+        # update不会发送post_save信号，在celery中更新商品的评论总数和最新评论，并清除详情页缓存
+        if commented:
+            publish_order_reviews.delay([order_goods.id for order_goods in commented], user.username)
 
         return redirect(reverse("user:order", kwargs={"page": 1}))
\ No newline at end of file
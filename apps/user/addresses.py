@@ -0,0 +1,24 @@
+from django.core.cache import cache
+from user.models import Address
+
+# 用户收货地址列表的缓存时间
+ADDRESS_CACHE_TIMEOUT = 3600
+
+
+def user_addresses_key(user_id):
+    return 'user_addresses_%d' % user_id
+
+
+def get_user_addresses(user_id):
+    """获取用户的所有收货地址，缓存中没有时查询数据库"""
+    key = user_addresses_key(user_id)
+    addrs = cache.get(key)
+    if addrs is None:
+        addrs = list(Address.objects.filter(user_id=user_id))
+        cache.set(key, addrs, ADDRESS_CACHE_TIMEOUT)
+    return addrs
+
+
+def invalidate_user_addresses(user_id):
+    """收货地址修改后清除缓存"""
+    cache.delete(user_addresses_key(user_id))
@@ -0,0 +1,10 @@
+from django.apps import AppConfig
+
+
+class UserConfig(AppConfig):
+    name = 'user'
+    verbose_name = '用户模块'
+
+    def ready(self):
+        # 注册缓存失效的信号处理函数
+        import user.signals
@@ -0,0 +1,28 @@
+from django.conf import settings
+
+# 记录用户浏览记录并返回购物车条目数，一次往返redis完成
+# KEYS[1]: history_用户id  KEYS[2]: cart_用户id
+# ARGV[1]: 商品id  ARGV[2]: 保存的浏览记录条数  ARGV[3]: 浏览记录的过期时间
+RECORD_HISTORY_SCRIPT = """
+redis.call('lrem', KEYS[1], 0, ARGV[1])
+redis.call('lpush', KEYS[1], ARGV[1])
+redis.call('ltrim', KEYS[1], 0, tonumber(ARGV[2]) - 1)
+redis.call('expire', KEYS[1], ARGV[3])
+return redis.call('hlen', KEYS[2])
+"""
+
+
+def history_key(user_id):
+    return 'history_%d' % user_id
+
+
+def record_history(conn, user_id, sku_id):
+    """添加用户的历史浏览记录，返回用户购物车中商品的条目数"""
+    script = conn.register_script(RECORD_HISTORY_SCRIPT)
+    return script(keys=[history_key(user_id), 'cart_%d' % user_id],
+                  args=[sku_id, settings.HISTORY_LENGTH, settings.HISTORY_TTL])
+
+
+def get_history(conn, user_id):
+    """获取用户最新浏览的商品id"""
+    return conn.lrange(history_key(user_id), 0, settings.HISTORY_LENGTH - 1)
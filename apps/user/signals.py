@@ -0,0 +1,10 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from user.models import Address
+from user.addresses import invalidate_user_addresses
+
+
+@receiver([post_save, post_delete], sender=Address)
+def address_changed(sender, instance, **kwargs):
+    """收货地址新增、修改或删除后，清除用户收货地址列表的缓存"""
+    invalidate_user_addresses(instance.user_id)
@@ -12,9 +12,12 @@ from celery_tasks.tasks import send_register_active_email
 from django.contrib.auth import authenticate, login, logout
 from utils.mixin import LoginRequiredMixin
 from django_redis import get_redis_connection
-from goods.models import GoodsSKU
+from goods.sku_snapshot import get_ordered_sku_snapshots
 from order.models import OrderInfo, OrderGoods
 from django.core.paginator import Paginator
+from user.history import get_history
+from cart.storage import get_guest_cart_id, merge_guest_cart, set_cart_count, restore_archived_cart, \
+    GUEST_CART_COOKIE
 
 # Create your views here.
 
@@ -171,6 +174,14 @@ class LoginView(View):
                 # 记录用户的登录状态
                 login(request, user)
 
+                # 恢复已归档的购物车，再合并未登录时添加的购物车记录
+                conn = get_redis_connection('default')
+                restore_archived_cart(conn, user.id)
+                guest_id = get_guest_cart_id(request)
+                if guest_id is not None:
+                    line_count, _ = merge_guest_cart(conn, guest_id, user.id)
+                    set_cart_count(request, line_count)
+
                 # 获取登录后所要跳转到的地址
                 # 默认跳转到首页。获取next的值为地址，如果没有，则设置为goods：next
                 next_url = request.GET.get('next', reverse('goods:index'))
@@ -186,6 +197,10 @@ class LoginView(View):
                 else:
                     response.delete_cookie('username')
 
+                if guest_id is not None:
+                    # 购物车已合并，删除cookie
+                    response.delete_cookie(GUEST_CART_COOKIE)
+
                 # 返回response
                 return response
             else:
@@ -227,10 +242,8 @@ class UserInfoView(LoginRequiredMixin, View):
         #str = StrictRedis(host='localhost', port='6379', db=9)
         con = get_redis_connection('default')
 
-        history_key = 'history_%d' % user.id
-
-        # 获取用户最新浏览的5条商品的id
-        sku_ids = con.lrange(history_key, 0, 4)
+        # 获取用户最新浏览的商品的id
+        sku_ids = get_history(con, user.id)
 
         # 从数据库中查询用户浏览的具体商品的信息
         #goods_li = GoodsSKU.objects.filter(id__in=sku_ids)
@@ -240,11 +253,8 @@ class UserInfoView(LoginRequiredMixin, View):
         #        if goods.id == a_id:
         #            goods_res.append(goods)
 
-        # 遍历，按顺序添加商品id
-        goods_li = []
-        for id in sku_ids:
-            goods = GoodsSKU.objects.get(id=id)
-            goods_li.append(goods)
+        # 批量获取商品快照，按浏览顺序排列
+        goods_li = get_ordered_sku_snapshots(sku_ids, con)
 
         # 组织上下文
         context = {'page': 'user',
@@ -261,7 +271,7 @@ class UserOderView(LoginRequiredMixin, View):
     def get(self, request, page):
         # 获取用户的订单信息
         user = request.user
-        orders = OrderInfo.objects.filter(user=user).order_by('-create_time')
+        orders = OrderInfo.objects.filter(user=user).order_by('-order_id')
 
         # 遍历获取订单商品的信息
         for order in orders:
@@ -4,6 +4,7 @@ from django.conf import settings
 
 from django_redis import get_redis_connection
 from django.template import loader
+from django.core.cache import cache
 
 # worker机器没有django初始化，所以需要在tasks文件中进行初始化
 import os
@@ -11,12 +12,40 @@ import django
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'dailyfresh.settings')
 django.setup()
 
-from goods.models import GoodsType, IndexGoodsBanner, IndexPromotionBanner, IndexTypeGoodsBanner
+from goods.index_page import get_index_page_data, is_index_generation_current, clear_index_dirty, \
+    write_static_index, INDEX_RENDER_LOCK_KEY
+from goods.stock import reconcile_stocks
+from cart.lifecycle import archive_idle_carts
+from order.flash_sale import persist_flash_sale_order
+from order.expiry import expire_unpaid_orders
+from order.models import OrderGoods
+from order.reviews import publish_reviews
+from goods.detail_page import invalidate_detail_pages
+from order.payment import check_payment, pay_poll_delay, finish_payment_poll, PAY_WAITING
 
 
 #创建一个Celery类的实例对象
 app = Celery('celery_tasks.tasks', broker='redis://xxx.xxx.xxx.xxx:xxxx/x')  # broker参数为redis数据库的ip、端口号和数据库索引
 
+# 定时任务，需要启动celery beat
+app.conf.update(CELERYBEAT_SCHEDULE={
+    # 定时用数据库核对redis中的商品库存缓存
+    'reconcile-stock-cache': {
+        'task': 'celery_tasks.tasks.reconcile_stock_cache',
+        'schedule': settings.STOCK_RECONCILE_INTERVAL,
+    },
+    # 定时把长期未访问的购物车归档到数据库
+    'archive-idle-carts': {
+        'task': 'celery_tasks.tasks.archive_carts',
+        'schedule': settings.CART_ARCHIVE_INTERVAL,
+    },
+    # 定时取消超过支付期限的订单
+    'expire-unpaid-orders': {
+        'task': 'celery_tasks.tasks.expire_orders',
+        'schedule': settings.ORDER_EXPIRY_CHECK_INTERVAL,
+    },
+})
+
 # 定义任务函数
 @app.task
 def send_register_active_email(to_email, username, token):
@@ -33,40 +62,79 @@ def send_register_active_email(to_email, username, token):
 
 
 @app.task
-def generate_static_index_html():
+def generate_static_index_html(generation=None):
     """产生静态首页"""
-    # 获取商品的种类信息
-    types = GoodsType.objects.all()
-
-    # 获取首页轮播商品信息
-    goods_banners = IndexGoodsBanner.objects.all().order_by('index')
-
-    # 获取首页促销活动信息
-    promotion_banners = IndexPromotionBanner.objects.all().order_by('index')
-
-    # 获取首页分类商品展示信息
-    for type in types:  # GoodsType
-        # 获取type种类首页分类商品的图片展示信息
-        image_banners = IndexTypeGoodsBanner.objects.filter(type=type, display_type=1).order_by('index')
-        # 获取type种类首页分类商品的文字展示信息
-        title_banners = IndexTypeGoodsBanner.objects.filter(type=type, display_type=0).order_by('index')
-
-        # 动态给type增加属性，分别保存首页分类商品的图片展示信息和文字展示信息
-        type.image_banners = image_banners
-        type.title_banners = title_banners
-
-    # 组织模板上下文
-    context = {'types': types,
-               'goods_banners': goods_banners,
-               'promotion_banners': promotion_banners}
-
-    # 使用模板
-    # 1.加载模板文件,返回模板对象
-    temp = loader.get_template('static_index.html')
-    # 2.模板渲染
-    static_index_html = temp.render(context)
-
-    # 生成首页对应静态文件
-    save_path = os.path.join(settings.BASE_DIR, 'static/index.html')
-    with open(save_path, 'w') as f:
-        f.write(static_index_html)
+    # generation为后台修改时调度的版本号，不传时无条件生成
+    conn = get_redis_connection('default')
+    if generation is not None and not is_index_generation_current(conn, generation):
+        # 静默期内又有新的修改，交给最后一次调度的任务生成
+        return
+
+    # 加锁之后再检查一次版本号，保证旧版本不会覆盖新版本
+    with conn.lock(INDEX_RENDER_LOCK_KEY, timeout=60):
+        if generation is not None and not is_index_generation_current(conn, generation):
+            return
+
+        # 组织模板上下文
+        context = get_index_page_data()
+
+        # 使用模板
+        # 1.加载模板文件,返回模板对象
+        temp = loader.get_template('static_index.html')
+        # 2.模板渲染
+        static_index_html = temp.render(context)
+
+        # 生成首页对应静态文件以及预压缩文件
+        write_static_index(static_index_html)
+
+        # 直接用新数据更新首页缓存，避免清除缓存后大量请求同时查询数据库
+        cache.set('index_page_data', context, 3600)
+
+        if generation is not None:
+            clear_index_dirty(conn, generation)
+
+
+@app.task
+def reconcile_stock_cache():
+    """用数据库中的库存修正redis中的库存缓存"""
+    return reconcile_stocks()
+
+
+@app.task
+def archive_carts():
+    """把长期未访问的购物车归档到数据库，返回归档报告"""
+    return archive_idle_carts()
+
+
+@app.task
+def create_flash_sale_order(order_id, user_id, addr_id, pay_method, transit_price, counts):
+    """把已预留库存的秒杀订单写入数据库"""
+    return persist_flash_sale_order(order_id, user_id, addr_id, pay_method, transit_price, counts)
+
+
+@app.task
+def poll_payment(order_id, attempt=0):
+    """查询订单的支付结果，买家还没有付款时按指数退避再次查询"""
+    try:
+        result = check_payment(order_id)
+    except Exception:
+        # 支付宝接口调用失败，按等待付款处理
+        result = PAY_WAITING
+    if result == PAY_WAITING and attempt < settings.PAY_POLL_MAX_ATTEMPTS:
+        poll_payment.apply_async((order_id, attempt + 1), countdown=pay_poll_delay(attempt + 1))
+    else:
+        finish_payment_poll(order_id)
+
+
+@app.task
+def expire_orders():
+    """取消超过支付期限的订单并归还库存"""
+    return expire_unpaid_orders()
+
+
+@app.task
+def publish_order_reviews(order_goods_ids, username):
+    """评论保存后更新商品的评论总数和最新评论，再清除详情页缓存"""
+    order_goods_list = list(OrderGoods.objects.filter(id__in=order_goods_ids))
+    publish_reviews(order_goods_list, username)
+    invalidate_detail_pages([order_goods.sku_id for order_goods in order_goods_list])
@@ -71,6 +71,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'cart.context_processors.cart_count', # 购物车条目数
             ],
         },
     },
@@ -154,6 +155,68 @@ CACHES = {
     }
 }
 
+# 后台修改首页数据后，等待多少秒没有新的修改再重新生成静态首页
+INDEX_REGENERATE_DELAY = 10
+
+# 详情页直接显示的最新评论条数，以及每次加载更多评论的条数
+REVIEW_LATEST_COUNT = 10
+
+# 保存用户最近浏览记录的条数
+HISTORY_LENGTH = 5
+
+# 浏览记录的有效期(秒)，长期不登录的用户的浏览记录自动过期
+HISTORY_TTL = 90 * 24 * 3600
+
+# session中保存的购物车条目数的有效时间(秒)
+CART_COUNT_SESSION_TTL = 60
+
+# worker进程内缓存的商品种类菜单，每隔多少秒检查一次redis中的版本号
+TYPE_MENU_CHECK_INTERVAL = 30
+
+# 购物车批量修改一次最多包含的操作数
+CART_BATCH_MAX_OPS = 100
+
+# 未登录用户购物车的有效期(秒)
+GUEST_CART_TTL = 7 * 24 * 3600
+
+# 每隔多少秒用数据库核对一次redis中的商品库存缓存
+STOCK_RECONCILE_INTERVAL = 300
+
+# 超过多少天未访问的购物车归档到数据库
+CART_ARCHIVE_IDLE_DAYS = 90
+
+# 每隔多少秒检查一次需要归档的购物车
+CART_ARCHIVE_INTERVAL = 24 * 3600
+
+# 秒杀订单状态在redis中保存的时间(秒)，需要大于队列积压时订单等待写入数据库的最长时间，
+# 写入数据库时会重新计时
+FLASH_SALE_ORDER_TTL = 24 * 3600
+
+# 支付宝接口配置
+ALIPAY_APPID = '2016101300678643'
+ALIPAY_GATEWAY_URL = 'https://openapi.alipaydev.com/gateway.do'
+ALIPAY_APP_PRIVATE_KEY_PATH = os.path.join(BASE_DIR, 'apps/order/app_private_key.pem')
+ALIPAY_PUBLIC_KEY_PATH = os.path.join(BASE_DIR, 'apps/order/alipay_public_key.pem')
+# 调用支付宝查询接口的超时时间(秒)
+ALIPAY_TIMEOUT = 5
+
+# 支付宝异步通知的地址，需要公网可以访问
+ALIPAY_NOTIFY_URL = 'http://xxx.xxx.xxx.xxx:xxxx/order/notify'
+
+# 后台轮询支付结果：第一次等待的秒数，每次加倍，最多等待的秒数和轮询次数
+PAY_POLL_INITIAL_DELAY = 5
+PAY_POLL_MAX_DELAY = 300
+PAY_POLL_MAX_ATTEMPTS = 12
+
+# 支付结果在redis中保存的时间(秒)
+PAY_STATUS_TTL = 3600
+
+# 订单的支付期限(秒)，超时未支付的订单自动取消并归还库存
+ORDER_PAY_TIMEOUT = 30 * 60
+# 每隔多少秒检查一次到期的订单，每批取消的订单数
+ORDER_EXPIRY_CHECK_INTERVAL = 30
+ORDER_EXPIRY_BATCH_SIZE = 100
+
 # 配置session存储
 SESSION_ENGINE = "django.contrib.sessions.backends.cache"
 SESSION_CACHE_ALIAS = "default"